@@ -0,0 +1,233 @@
+"""Module for augmenting whole batches of images inside the tf.data pipeline."""
+import math
+import tensorflow as tf
+
+
+MAX_ROTATION = 10.0
+MAX_SHIFT = 2.0
+MAX_ZOOM = 0.1
+ELASTIC_ALPHA = 34.0
+ELASTIC_SIGMA = 4.0
+
+
+def gaussian_kernel(sigma):
+    """
+    Build normalized 1d gaussian kernel of radius 2 * sigma.
+
+    Parameters
+    ----------
+        sigma : float
+
+    Returns
+    -------
+        kernel : tensor
+            float32. shape = (2 * radius + 1,)
+    """
+    radius = max(int(2 * sigma), 1)
+    x = tf.range(-radius, radius + 1, dtype=tf.float32)
+    kernel = tf.exp(-0.5 * tf.square(x / sigma))
+    return kernel / tf.reduce_sum(kernel)
+
+
+def affine_transforms(batch_size, height, width, seed):
+    """
+    Draw random rotation, shift and zoom for every image of a batch.
+
+    Parameters
+    ----------
+        batch_size : tensor
+        height : int
+        width : int
+        seed : tensor
+            int64 stateless seed. shape = (2,)
+
+    Returns
+    -------
+        transforms : tensor
+            rows [a0, a1, a2, b0, b1, b2, 0, 0] mapping output to input
+            points, as ImageProjectiveTransformV3 takes them. shape = (, 8)
+    """
+    seeds = tf.random.experimental.stateless_split(seed, 3)
+    limit = MAX_ROTATION * math.pi / 180.0
+    angle = tf.random.stateless_uniform((batch_size,), seeds[0], -limit, limit)
+    shift = tf.random.stateless_uniform(
+        (batch_size, 2), seeds[1], -MAX_SHIFT, MAX_SHIFT
+    )
+    zoom = tf.random.stateless_uniform(
+        (batch_size,), seeds[2], 1.0 - MAX_ZOOM, 1.0 + MAX_ZOOM
+    )
+
+    center_x = (width - 1) / 2.0
+    center_y = (height - 1) / 2.0
+    a0 = tf.cos(angle) / zoom
+    a1 = tf.sin(angle) / zoom
+    b0 = -a1
+    b1 = a0
+    # Input point of (x, y) is the inverse rotation and zoom of (x, y) - shift about the center.
+    x = center_x + shift[:, 0]
+    y = center_y + shift[:, 1]
+    a2 = center_x - a0 * x - a1 * y
+    b2 = center_y - b0 * x - b1 * y
+    zeros = tf.zeros_like(angle)
+    return tf.stack([a0, a1, a2, b0, b1, b2, zeros, zeros], axis=1)
+
+
+def warp(images, dy, dx):
+    """
+    Move every pixel by its own displacement with bilinear sampling.
+
+    Parameters
+    ----------
+        images : tensor
+            float32 image batch. shape = (, height, width, channels)
+        dy : tensor
+            rows to sample from, relative to each pixel. shape = (, height, width)
+        dx : tensor
+            columns to sample from, relative to each pixel. shape = (, height, width)
+
+    Returns
+    -------
+        warped : tensor
+            float32 image batch. pixels sampled from outside are 0.
+    """
+    shape = tf.shape(images)
+    batch_size, height, width, channels = shape[0], shape[1], shape[2], shape[3]
+    grid_y, grid_x = tf.meshgrid(
+        tf.range(height, dtype=tf.float32),
+        tf.range(width, dtype=tf.float32),
+        indexing="ij",
+    )
+    y = grid_y + dy
+    x = grid_x + dx
+    y0 = tf.floor(y)
+    x0 = tf.floor(x)
+    weight_y = (y - y0)[..., tf.newaxis]
+    weight_x = (x - x0)[..., tf.newaxis]
+    y0 = tf.cast(y0, tf.int32)
+    x0 = tf.cast(x0, tf.int32)
+
+    flat = tf.reshape(images, (batch_size, height * width, channels))
+
+    def gather(rows, columns):
+        inside = (rows >= 0) & (rows < height) & (columns >= 0) & (columns < width)
+        index = tf.clip_by_value(rows, 0, height - 1) * width + tf.clip_by_value(
+            columns, 0, width - 1
+        )
+        index = tf.reshape(index, (batch_size, height * width))
+        values = tf.reshape(
+            tf.gather(flat, index, batch_dims=1),
+            (batch_size, height, width, channels),
+        )
+        return values * tf.cast(inside, images.dtype)[..., tf.newaxis]
+
+    top = (1.0 - weight_x) * gather(y0, x0) + weight_x * gather(y0, x0 + 1)
+    bottom = (1.0 - weight_x) * gather(y0 + 1, x0) + weight_x * gather(
+        y0 + 1, x0 + 1
+    )
+    return (1.0 - weight_y) * top + weight_y * bottom
+
+
+def elastic_distortion(images, seed, alpha=ELASTIC_ALPHA, sigma=ELASTIC_SIGMA):
+    """
+    Distort images by random displacement fields smoothed with a gaussian.
+
+    Parameters
+    ----------
+        images : tensor
+            float32 image batch. shape = (, height, width, channels)
+        seed : tensor
+            int64 stateless seed. shape = (2,)
+        alpha : float
+            strength of the displacement.
+        sigma : float
+            smoothness of the displacement.
+
+    Returns
+    -------
+        distorted : tensor
+    """
+    shape = tf.shape(images)
+    field = tf.random.stateless_uniform(
+        (shape[0], shape[1], shape[2], 2), seed, -1.0, 1.0
+    )
+    # Separable blur of both displacement channels at once.
+    kernel = gaussian_kernel(sigma)
+    size = kernel.shape[0]
+    field = tf.nn.depthwise_conv2d(
+        field,
+        tf.tile(tf.reshape(kernel, (size, 1, 1, 1)), (1, 1, 2, 1)),
+        (1, 1, 1, 1),
+        "SAME",
+    )
+    field = tf.nn.depthwise_conv2d(
+        field,
+        tf.tile(tf.reshape(kernel, (1, size, 1, 1)), (1, 1, 2, 1)),
+        (1, 1, 1, 1),
+        "SAME",
+    )
+    field = alpha * field
+    return warp(images, field[..., 0], field[..., 1])
+
+
+def augment(images, labels, seed):
+    """
+    Randomly distort, rotate, shift and zoom a batch of images.
+
+    Parameters
+    ----------
+        images : tensor
+            float32 image batch. shape = (, 28, 28, 1)
+        labels : tensor
+            label batch.
+        seed : tensor
+            int64 stateless seed. shape = (2,)
+            the same seed gives the same augmentation.
+
+    Returns
+    -------
+        images : tensor
+        labels : tensor
+    """
+    elastic_seed, affine_seed = tf.unstack(
+        tf.random.experimental.stateless_split(seed, 2)
+    )
+    if ELASTIC_ALPHA > 0:
+        images = elastic_distortion(images, elastic_seed)
+
+    shape = tf.shape(images)
+    transforms = affine_transforms(shape[0], 28, 28, affine_seed)
+    images = tf.raw_ops.ImageProjectiveTransformV3(
+        images=images,
+        transforms=transforms,
+        output_shape=shape[1:3],
+        fill_value=0.0,
+        interpolation="BILINEAR",
+        fill_mode="CONSTANT",
+    )
+    return images, labels
+
+
+def augment_dataset(dataset, seed=None):
+    """
+    Augment batches of a dataset in parallel.
+
+    Every batch gets its own stateless seed drawn from tf.data.Dataset.random,
+    so a given seed reproduces the same augmentation in every run while each
+    epoch still sees new distortions.
+
+    Parameters
+    ----------
+        dataset : tf.data.Dataset
+            normalized (images, labels) batches.
+        seed : int or None
+            None for a different augmentation every run.
+
+    Returns
+    -------
+        dataset : tf.data.Dataset
+    """
+    seeds = tf.data.Dataset.random(seed=seed, rerandomize_each_iteration=True).batch(2)
+    return tf.data.Dataset.zip((dataset, seeds)).map(
+        lambda batch, batch_seed: augment(batch[0], batch[1], batch_seed),
+        num_parallel_calls=tf.data.AUTOTUNE,
+    )
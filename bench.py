@@ -0,0 +1,645 @@
+"""Module for benchmarking training and inference on synthetic MNIST-shaped data."""
+import os
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from main import build_training
+from main import train
+from model import ARCHITECTURES
+from model import count_flops
+from model import Model
+from training import make_optimizer
+from training import make_train_step
+from training import set_precision
+from validation import make_eval_step
+from inference import make_predict_step
+from utils import get_data
+from utils import get_dataset
+from utils import get_train_dataset
+from utils import normalize
+from utils import read_csv
+from config import VALIDATION_NUM
+
+
+BATCH_SIZE = 16
+LEARNING_RATE = 0.01
+NUM_IMAGES = 4096
+WARMUP_STEPS = 5
+TIMED_STEPS = 100
+REPEATS = 3
+INFERENCE_BATCH_SIZES = [1, 32, 256, 1024]
+HISTORY_PATH = "./bench_history.json"
+ARCHITECTURE_EPOCHS = 3
+LATENCY_CALLS = 200
+THRESHOLD = 0.1
+
+# name: (precision policy, jit_compile, loss_scale)
+TRAIN_MODES = {
+    "float32": ("float32", False, False),
+    "float32_xla": ("float32", True, False),
+    "mixed_bfloat16": ("mixed_bfloat16", False, True),
+    "mixed_bfloat16_xla": ("mixed_bfloat16", True, True),
+}
+
+
+def synthetic_data(num_images=NUM_IMAGES, seed=0):
+    """
+    Make random uint8 images and labels of MNIST shape.
+
+    Parameters
+    ----------
+        num_images : int
+        seed : int
+
+    Returns
+    -------
+        features : ndarray
+            shape = (num_images, 28, 28, 1), dtype = uint8
+        label : ndarray
+            shape = (num_images,), dtype = uint8
+    """
+    rng = np.random.default_rng(seed)
+    features = rng.integers(0, 256, (num_images, 28, 28, 1), dtype=np.uint8)
+    label = rng.integers(0, 10, num_images, dtype=np.uint8)
+    return features, label
+
+
+def time_steps(step, batches, sync, warmup_steps=WARMUP_STEPS):
+    """
+    Time a compiled step over batches after warming it up.
+
+    Parameters
+    ----------
+        step : tf.function
+            takes (images, labels).
+        batches : list of (tensor, tensor)
+        sync : callable
+            blocks until the last step has finished, e.g. by reading a metric.
+        warmup_steps : int
+            steps run before timing, to trace and compile step.
+
+    Returns
+    -------
+        seconds : float
+            wall-clock time of the timed steps.
+    """
+    for images, labels in batches[:warmup_steps]:
+        step(images, labels)
+    sync()
+
+    start = time.perf_counter()
+    for images, labels in batches[warmup_steps:]:
+        step(images, labels)
+    sync()
+    return time.perf_counter() - start
+
+
+def bench_train_mode(
+    policy,
+    jit_compile,
+    loss_scale,
+    features,
+    label,
+    batch_size=BATCH_SIZE,
+    steps=TIMED_STEPS,
+):
+    """
+    Measure train steps per second of one precision/compiler mode.
+
+    Parameters
+    ----------
+        policy : string
+            precision policy passed to training.set_precision.
+        jit_compile : boolean
+        loss_scale : boolean
+        features : ndarray
+        label : ndarray
+        batch_size : int
+        steps : int
+            number of timed steps.
+
+    Returns
+    -------
+        stats : dict
+            steps_per_second and images_per_second.
+    """
+    set_precision(policy)
+    try:
+        model = Model()
+        loss_object = tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True)
+        optimizer = make_optimizer(LEARNING_RATE, loss_scale)
+        metrics_loss = tf.keras.metrics.Mean()
+        metrics_accuracy = tf.keras.metrics.SparseCategoricalAccuracy()
+        train_step = make_train_step(
+            model,
+            loss_object,
+            optimizer,
+            metrics_loss,
+            metrics_accuracy,
+            jit_compile=jit_compile,
+        )
+
+        dataset = get_dataset(features, label, batch_size).repeat()
+        batches = list(dataset.take(WARMUP_STEPS + steps))
+        seconds = time_steps(
+            train_step, batches, lambda: metrics_loss.result().numpy()
+        )
+    finally:
+        set_precision("float32")
+
+    return {
+        "steps_per_second": steps / seconds,
+        "images_per_second": steps * batch_size / seconds,
+    }
+
+
+def bench_architecture(
+    architecture,
+    features,
+    label,
+    batch_size=BATCH_SIZE,
+    steps=TIMED_STEPS,
+    train_path=None,
+    epochs=ARCHITECTURE_EPOCHS,
+):
+    """
+    Measure size, cost, speed and optionally accuracy of one architecture.
+
+    Parameters
+    ----------
+        architecture : string
+            key of model.ARCHITECTURES.
+        features : ndarray
+        label : ndarray
+            synthetic data for timing.
+        batch_size : int
+        steps : int
+            number of timed train steps.
+        train_path : string or None
+            labeled csv to train on for validation accuracy. skipped if None.
+        epochs : int
+            epochs trained for validation accuracy.
+
+    Returns
+    -------
+        stats : dict
+            params, flops, train_images_per_second, p50_latency_ms of one
+            image, inference_images_per_second at batch 1024 and
+            validation_accuracy (None without train_path).
+    """
+    model, loss_object, optimizer, metrics_loss, metrics_accuracy = build_training(
+        batch_size=batch_size, architecture=architecture
+    )
+    train_step = make_train_step(
+        model, loss_object, optimizer, metrics_loss, metrics_accuracy
+    )
+    dataset = get_dataset(features, label, batch_size).repeat()
+    batches = list(dataset.take(WARMUP_STEPS + steps))
+    seconds = time_steps(train_step, batches, lambda: metrics_loss.result().numpy())
+
+    predict_step = make_predict_step(model)
+    image = tf.constant(features[:1])
+    predict_step(image).numpy()
+    latencies = []
+    for _ in range(LATENCY_CALLS):
+        start = time.perf_counter()
+        predict_step(image).numpy()
+        latencies.append(time.perf_counter() - start)
+    big_batch = tf.constant(features[:1024])
+    predict_step(big_batch).numpy()
+    inference_seconds = median_time(lambda: predict_step(big_batch).numpy())
+
+    stats = {
+        "params": model.count_params(),
+        "flops": count_flops(model),
+        "train_images_per_second": steps * batch_size / seconds,
+        "p50_latency_ms": float(np.median(latencies)) * 1000.0,
+        "inference_images_per_second": len(big_batch) / inference_seconds,
+        "validation_accuracy": None,
+    }
+
+    if train_path is not None:
+        model, loss_object, optimizer, metrics_loss, metrics_accuracy = (
+            build_training(batch_size=batch_size, architecture=architecture)
+        )
+        train_dataset, validation_dataset = get_train_dataset(
+            train_path, VALIDATION_NUM, batch_size
+        )
+        record = train(
+            train_dataset,
+            validation_dataset,
+            model,
+            loss_object,
+            optimizer,
+            epochs,
+            metrics_loss,
+            metrics_accuracy,
+            metrics_loss,
+            metrics_accuracy,
+        )
+        stats["validation_accuracy"] = record["validation_accuracy"]
+
+    return stats
+
+
+def median_time(function, repeats=REPEATS):
+    """
+    Run function several times and return the median wall-clock time.
+
+    Parameters
+    ----------
+        function : callable
+        repeats : int
+
+    Returns
+    -------
+        seconds : float
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def write_csv(path, features, label):
+    """
+    Write images and labels in the format of the kaggle train.csv.
+
+    Parameters
+    ----------
+        path : string
+        features : ndarray
+        label : ndarray
+    """
+    data = pd.DataFrame(
+        features.reshape(len(features), -1),
+        columns=["pixel{}".format(i) for i in range(28 * 28)],
+    )
+    data.insert(0, "label", label)
+    data.to_csv(path, index=False)
+
+
+def bench_csv_load(features, label, repeats=REPEATS):
+    """
+    Measure parsing the csv and loading it from the binary cache.
+
+    Returns
+    -------
+        results : dict
+            images per second of each benchmark.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "train.csv")
+        write_csv(path, features, label)
+        get_data(path)
+
+        parse = median_time(lambda: read_csv(path), repeats)
+        # Touch every page so the memory-mapped load is really read.
+        cached = median_time(lambda: np.asarray(get_data(path)[0]).sum(), repeats)
+
+    return {
+        "csv_parse": len(label) / parse,
+        "csv_cached_load": len(label) / cached,
+    }
+
+
+def bench_normalize(features, label, batch_size=BATCH_SIZE, repeats=REPEATS):
+    # The pipeline runs normalize on every batch as a traced function.
+    normalize_batch = tf.function(normalize)
+    batches = [
+        (
+            tf.constant(features[start : start + batch_size]),
+            tf.constant(label[start : start + batch_size]),
+        )
+        for start in range(0, len(label) - batch_size + 1, batch_size)
+    ]
+
+    def normalize_all():
+        for images, labels in batches:
+            normalize_batch(images, labels)
+
+    normalize_all()
+    seconds = median_time(normalize_all, repeats)
+    return {"normalize": len(batches) * batch_size / seconds}
+
+
+def bench_pipeline(features, label, batch_size=BATCH_SIZE, repeats=REPEATS):
+    results = {}
+    for name, augment in (("pipeline", False), ("pipeline_augment", True)):
+        dataset = get_dataset(features, label, batch_size, augment=augment, seed=0)
+
+        def consume():
+            for _ in dataset:
+                pass
+
+        consume()
+        results[name] = len(label) / median_time(consume, repeats)
+    return results
+
+
+def bench_steps(features, label, batch_size=BATCH_SIZE, steps=TIMED_STEPS):
+    """
+    Measure float32 train step and eval step.
+
+    Returns
+    -------
+        results : dict
+            images per second of each benchmark.
+    """
+    model = Model()
+    loss_object = tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True)
+    optimizer = make_optimizer(LEARNING_RATE)
+    metrics_loss = tf.keras.metrics.Mean()
+    metrics_accuracy = tf.keras.metrics.SparseCategoricalAccuracy()
+    train_step = make_train_step(
+        model, loss_object, optimizer, metrics_loss, metrics_accuracy
+    )
+    eval_step = make_eval_step(model, loss_object, metrics_loss, metrics_accuracy)
+
+    dataset = get_dataset(features, label, batch_size).repeat()
+    batches = list(dataset.take(WARMUP_STEPS + steps))
+
+    def sync():
+        metrics_loss.result().numpy()
+
+    return {
+        "train_step": steps * batch_size / time_steps(train_step, batches, sync),
+        "eval_step": steps * batch_size / time_steps(eval_step, batches, sync),
+    }
+
+
+def bench_inference(features, batch_sizes=INFERENCE_BATCH_SIZES, repeats=REPEATS):
+    """
+    Measure compiled inference at several batch sizes.
+
+    Returns
+    -------
+        results : dict
+            images per second per batch size.
+    """
+    predict_step = make_predict_step(Model())
+    results = {}
+    for batch_size in batch_sizes:
+        batches = [
+            tf.constant(features[start : start + batch_size])
+            for start in range(0, len(features) - batch_size + 1, batch_size)
+        ]
+        predict_step(batches[0]).numpy()
+
+        def predict_all():
+            for images in batches:
+                predict_step(images).numpy()
+
+        seconds = median_time(predict_all, repeats)
+        results["inference_batch_{}".format(batch_size)] = (
+            len(batches) * batch_size / seconds
+        )
+    return results
+
+
+BENCHMARKS = {
+    "csv": lambda features, label: bench_csv_load(features, label),
+    "normalize": lambda features, label: bench_normalize(features, label),
+    "pipeline": lambda features, label: bench_pipeline(features, label),
+    "steps": lambda features, label: bench_steps(features, label),
+    "inference": lambda features, label: bench_inference(features),
+}
+
+
+def run_suite(names=None, num_images=NUM_IMAGES, seed=0):
+    """
+    Run benchmarks on synthetic data.
+
+    Parameters
+    ----------
+        names : list of string or None
+            keys of BENCHMARKS. every benchmark if None.
+        num_images : int
+        seed : int
+            seed of the synthetic data and of tensorflow.
+
+    Returns
+    -------
+        results : dict
+            images per second per benchmark. higher is better for every entry.
+    """
+    tf.random.set_seed(seed)
+    features, label = synthetic_data(num_images, seed)
+
+    results = {}
+    for name in names or list(BENCHMARKS):
+        results.update(BENCHMARKS[name](features, label))
+    return results
+
+
+def git_commit():
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+def load_history(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def save_run(path, results):
+    """
+    Append results to the json history.
+
+    Parameters
+    ----------
+        path : string
+        results : dict
+
+    Returns
+    -------
+        run : dict
+            the appended entry.
+    """
+    history = load_history(path)
+    run = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "results": results,
+    }
+    history.append(run)
+    with open(path, "w") as f:
+        json.dump(history, f, indent=2)
+    return run
+
+
+def compare_runs(baseline, current, threshold=THRESHOLD):
+    """
+    Compare two runs of the history.
+
+    Parameters
+    ----------
+        baseline : dict
+        current : dict
+        threshold : float
+            relative slowdown reported as regression, e.g. 0.1 for 10%.
+
+    Returns
+    -------
+        rows : list of (string, float, float, float, boolean)
+            name, baseline, current, relative change and whether it regressed.
+    """
+    rows = []
+    for name, value in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        base = baseline["results"][name]
+        if base == 0:
+            change = 0.0 if value == 0 else float("inf")
+        else:
+            change = (value - base) / base
+        rows.append((name, base, value, change, change < -threshold))
+    return rows
+
+
+def print_results(results):
+    print("{:<24}{:>14}".format("benchmark", "images/sec"))
+    for name, value in results.items():
+        print("{:<24}{:>14.0f}".format(name, value))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark hot paths.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run benchmarks and save them")
+    run_parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS))
+    run_parser.add_argument("--num-images", type=int, default=NUM_IMAGES)
+    run_parser.add_argument("--history", default=HISTORY_PATH)
+    run_parser.add_argument("--no-save", action="store_true")
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare the last run with an earlier one"
+    )
+    compare_parser.add_argument("--history", default=HISTORY_PATH)
+    compare_parser.add_argument(
+        "--baseline",
+        type=int,
+        default=-2,
+        help="index of the baseline run in the history. default is the one "
+        "before last",
+    )
+    compare_parser.add_argument("--threshold", type=float, default=THRESHOLD)
+
+    modes_parser = subparsers.add_parser("modes", help="compare training modes")
+    modes_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    modes_parser.add_argument("--steps", type=int, default=TIMED_STEPS)
+    modes_parser.add_argument(
+        "--modes", nargs="+", default=list(TRAIN_MODES), choices=list(TRAIN_MODES)
+    )
+    architectures_parser = subparsers.add_parser(
+        "architectures", help="compare cost and accuracy of model architectures"
+    )
+    architectures_parser.add_argument(
+        "--names",
+        nargs="+",
+        default=list(ARCHITECTURES),
+        choices=list(ARCHITECTURES),
+    )
+    architectures_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    architectures_parser.add_argument("--steps", type=int, default=TIMED_STEPS)
+    architectures_parser.add_argument(
+        "--train-path",
+        help="labeled csv to measure validation accuracy on. skipped if not given",
+    )
+    architectures_parser.add_argument(
+        "--epochs", type=int, default=ARCHITECTURE_EPOCHS
+    )
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = run_suite(args.only, args.num_images)
+        print_results(results)
+        if not args.no_save:
+            save_run(args.history, results)
+
+    elif args.command == "compare":
+        history = load_history(args.history)
+        if len(history) < 2:
+            parser.error("need at least two runs in {}".format(args.history))
+        rows = compare_runs(history[args.baseline], history[-1], args.threshold)
+        print(
+            "{:<24}{:>12}{:>12}{:>10}".format(
+                "benchmark", "baseline", "current", "change"
+            )
+        )
+        for name, base, value, change, regressed in rows:
+            print(
+                "{:<24}{:>12.0f}{:>12.0f}{:>+9.1%}{}".format(
+                    name, base, value, change, "  REGRESSION" if regressed else ""
+                )
+            )
+        if any(row[-1] for row in rows):
+            raise SystemExit(1)
+
+    elif args.command == "architectures":
+        features, label = synthetic_data()
+        print(
+            "{:<12}{:>10}{:>10}{:>14}{:>10}{:>14}{:>10}".format(
+                "model",
+                "params",
+                "MFLOPs",
+                "train img/s",
+                "p50(ms)",
+                "infer img/s",
+                "val_acc",
+            )
+        )
+        for name in args.names:
+            stats = bench_architecture(
+                name,
+                features,
+                label,
+                args.batch_size,
+                args.steps,
+                args.train_path,
+                args.epochs,
+            )
+            accuracy = stats["validation_accuracy"]
+            print(
+                "{:<12}{:>10}{:>10.2f}{:>14.0f}{:>10.3f}{:>14.0f}{:>10}".format(
+                    name,
+                    stats["params"],
+                    stats["flops"] / 1e6,
+                    stats["train_images_per_second"],
+                    stats["p50_latency_ms"],
+                    stats["inference_images_per_second"],
+                    "-" if accuracy is None else "{:.4f}".format(accuracy),
+                )
+            )
+
+    else:
+        features, label = synthetic_data()
+        print("{:<22}{:>12}{:>14}".format("mode", "steps/sec", "images/sec"))
+        for name in args.modes:
+            stats = bench_train_mode(
+                *TRAIN_MODES[name], features, label, args.batch_size, args.steps
+            )
+            print(
+                "{:<22}{steps_per_second:>12.1f}{images_per_second:>14.0f}".format(
+                    name, **stats
+                )
+            )
@@ -0,0 +1,97 @@
+"""Module for fixed-size metric storage and downsampling for plots."""
+import numpy as np
+
+
+class RingBuffer:
+    """
+    A class to keep the latest values of a series in a preallocated array.
+
+    Attributes
+    ----------
+        capacity : int
+            maximum number of values kept.
+        data : ndarray
+            preallocated storage. shape = (capacity, *shape)
+
+    Methods
+    -------
+        append(value):
+            add value, overwriting the oldest one if full.
+        values():
+            return kept values from oldest to newest.
+        last():
+            return the newest value.
+    """
+
+    def __init__(self, capacity, shape=(), dtype=np.float64):
+        """
+        Initialize buffer.
+
+        Parameters
+        ----------
+            capacity : int
+            shape : tuple
+                shape of one value.
+            dtype : numpy dtype
+        """
+        self.capacity = capacity
+        self.data = np.zeros((capacity,) + tuple(shape), dtype=dtype)
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, value):
+        end = (self.start + self.size) % self.capacity
+        self.data[end] = value
+        if self.size < self.capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    def values(self):
+        end = self.start + self.size
+        if end <= self.capacity:
+            return self.data[self.start : end]
+        return np.concatenate(
+            (self.data[self.start :], self.data[: end - self.capacity])
+        )
+
+    def last(self):
+        if self.size == 0:
+            raise IndexError("last from empty RingBuffer")
+        return self.data[(self.start + self.size - 1) % self.capacity]
+
+
+def downsample_minmax(x, y, max_points):
+    """
+    Reduce a series to at most max_points points keeping min and max of each bucket.
+
+    Parameters
+    ----------
+        x : ndarray
+        y : ndarray
+        max_points : int
+
+    Returns
+    -------
+        x : ndarray
+        y : ndarray
+    """
+    num = len(y)
+    buckets = max_points // 2
+    if num <= max_points or buckets == 0:
+        return x, y
+
+    bucket_size = -(-num // buckets)
+    padded = np.pad(y, (0, buckets * bucket_size - num), mode="edge")
+    padded = padded.reshape(buckets, bucket_size)
+
+    offsets = np.arange(buckets) * bucket_size
+    index = np.stack(
+        (offsets + padded.argmin(axis=1), offsets + padded.argmax(axis=1)), axis=1
+    )
+    index = np.unique(np.minimum(index.ravel(), num - 1))
+
+    return x[index], y[index]
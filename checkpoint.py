@@ -0,0 +1,115 @@
+"""Module for saving and restoring training state."""
+from concurrent.futures import ThreadPoolExecutor
+import tensorflow as tf
+
+
+class Checkpointer:
+    """
+    A class to save model, optimizer and epoch counter without blocking training.
+
+    On save, every variable is copied into a snapshot variable on the calling
+    thread, and the snapshot is written to disk by a background thread, so the
+    training loop only waits for the in-memory copy.
+
+    Attributes
+    ----------
+        variables : list of tf.Variable
+            variables of model and optimizer, the epoch counter and elapsed.
+        elapsed : tf.Variable
+            seconds of training up to the saved epoch, over every run.
+        snapshot : list of tf.Variable
+            copies of variables written to disk.
+        checkpoint : tf.train.Checkpoint
+        manager : tf.train.CheckpointManager
+
+    Methods
+    -------
+        restore():
+            restore latest checkpoint and return its epoch.
+        save(epoch, elapsed):
+            save state after epoch.
+        sync():
+            wait until every save is written.
+    """
+
+    def __init__(self, directory, model, optimizer, max_to_keep=3):
+        """
+        Initialize checkpointer.
+
+        Parameters
+        ----------
+            directory : string
+                directory of checkpoints.
+            model : tf.keras.Model
+            optimizer : tf.keras.optimizers
+            max_to_keep : int
+                number of latest checkpoints kept on disk.
+        """
+        # Create every variable of model and optimizer now.
+        model(tf.zeros((1, 28, 28, 1)), training=False)
+        optimizer.build(model.trainable_variables)
+
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.elapsed = tf.Variable(0.0, dtype=tf.float64, trainable=False)
+        self.variables = list(model.variables) + list(optimizer.variables)
+        self.variables.append(self.epoch)
+        self.variables.append(self.elapsed)
+        self.snapshot = [
+            tf.Variable(variable, trainable=False) for variable in self.variables
+        ]
+
+        self.checkpoint = tf.train.Checkpoint(variables=self.snapshot)
+        self.manager = tf.train.CheckpointManager(
+            self.checkpoint, directory, max_to_keep=max_to_keep
+        )
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    @staticmethod
+    def copy_variables(sources, targets):
+        for source, target in zip(sources, targets):
+            target.assign(source)
+
+    def restore(self):
+        """
+        Restore latest checkpoint.
+
+        Returns
+        -------
+            epoch : int
+                last finished epoch of the checkpoint. 0 if there is none.
+                seconds trained until then are left in elapsed.
+        """
+        self.sync()
+        if self.manager.latest_checkpoint is None:
+            return 0
+
+        self.checkpoint.restore(self.manager.latest_checkpoint).assert_consumed()
+        self.copy_variables(self.snapshot, self.variables)
+        return int(self.epoch.numpy())
+
+    def save(self, epoch, elapsed=0.0):
+        """
+        Save state after epoch. Returns before the files are written.
+
+        Parameters
+        ----------
+            epoch : int
+                last finished epoch.
+            elapsed : float
+                seconds of training up to epoch, so time to accuracy can
+                continue counting after a restore.
+        """
+        # The snapshot can only be overwritten once the last write is done.
+        self.sync()
+        self.epoch.assign(epoch)
+        self.elapsed.assign(elapsed)
+        self.copy_variables(self.variables, self.snapshot)
+        self.pending = self.executor.submit(
+            self.manager.save, checkpoint_number=epoch
+        )
+
+    def sync(self):
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
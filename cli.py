@@ -0,0 +1,256 @@
+"""Command line interface with one subcommand per task.
+
+Only the standard library is imported at startup. Every subcommand imports
+the modules it needs when it runs, so listing subcommands or asking for help
+does not pay for importing tensorflow.
+"""
+import sys
+import time
+import argparse
+import importlib
+import importlib.util
+from config import TRAIN_DATA_PATH
+from config import TEST_DATA_PATH
+from config import SUBMISSION_PATH
+from config import WEIGHTS_PATH
+from config import NPZ_PATH
+from config import TFLITE_PATH
+from config import INT8_TFLITE_PATH
+from config import VALIDATION_NUM
+from config import ARCHITECTURE
+from config import ARCHITECTURE_NAMES
+
+
+START_TIME = time.perf_counter()
+
+BATCH_SIZE = 1024
+EXPORT_FORMATS = ("npz", "tflite", "int8")
+
+IMPORT_TIMES = {}
+
+
+def timed_import(name):
+    """
+    Import module and remember how long it took.
+
+    Modules imported by an earlier call are not counted again, so import
+    tensorflow first to separate its cost from the modules using it.
+
+    Parameters
+    ----------
+        name : string
+
+    Returns
+    -------
+        module : module
+    """
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    IMPORT_TIMES.setdefault(name, time.perf_counter() - start)
+    return module
+
+
+def print_import_report(file=sys.stderr):
+    print("{:<20}{:>10}".format("import", "seconds"), file=file)
+    for name, seconds in IMPORT_TIMES.items():
+        print("{:<20}{:>10.3f}".format(name, seconds), file=file)
+    print(
+        "{:<20}{:>10.3f}".format("total", time.perf_counter() - START_TIME),
+        file=file,
+    )
+
+
+def run_train(args, extra):
+    timed_import("tensorflow")
+    main = timed_import("main")
+
+    parser = argparse.ArgumentParser(prog="cli.py train", description="Train model.")
+    main.add_train_arguments(parser)
+    return main.run_training(parser.parse_args(extra))
+
+
+def run_eval(args, extra):
+    timed_import("tensorflow")
+    inference = timed_import("inference")
+
+    loss, accuracy = inference.evaluate(
+        inference.load_model(args.weights, args.architecture),
+        args.train_path,
+        args.validation_num,
+        args.batch_size,
+    )
+    print("validation loss {:.4f}, accuracy {:.4f}".format(loss, accuracy))
+    return 0
+
+
+def run_predict(args, extra):
+    timed_import("tensorflow")
+    inference = timed_import("inference")
+
+    stats = inference.predict(
+        inference.load_model(args.weights, args.architecture),
+        args.test_path,
+        args.output,
+        args.batch_size,
+    )
+    print(
+        "{images} images in {seconds:.2f}s, {images_per_second:.0f} images/sec".format(
+            **stats
+        )
+    )
+    return 0
+
+
+def run_export(args, extra):
+    if args.format == "npz" and args.architecture != "baseline":
+        make_parser().error("numpy_model only runs the baseline architecture")
+
+    timed_import("tensorflow")
+    inference = timed_import("inference")
+    model = inference.load_model(args.weights, args.architecture)
+
+    if args.format == "npz":
+        numpy_model = timed_import("numpy_model")
+        numpy_model.export_weights(model, args.output or NPZ_PATH)
+    else:
+        quantize = timed_import("quantize")
+        calibration_dataset = None
+        if args.format == "int8":
+            utils = timed_import("utils")
+            calibration_dataset, _ = utils.get_train_dataset(
+                args.train_path, args.validation_num, quantize.BATCH_SIZE
+            )
+        contents = quantize.convert(model, calibration_dataset)
+        output = args.output or (INT8_TFLITE_PATH if args.format == "int8" else TFLITE_PATH)
+        with open(output, "wb") as f:
+            f.write(contents)
+    return 0
+
+
+def run_script(name, extra):
+    """
+    Run the command line of module name with arguments extra.
+
+    Returns
+    -------
+        status : int
+    """
+    import runpy
+
+    sys.argv = ["cli.py " + name] + extra
+    try:
+        runpy.run_path(importlib.util.find_spec(name).origin, run_name="__main__")
+    except SystemExit as error:
+        return error.code or 0
+    return 0
+
+
+def run_bench(args, extra):
+    timed_import("tensorflow")
+    return run_script("bench", extra)
+
+
+def run_sweep(args, extra):
+    return run_script("sweep", extra)
+
+
+def run_crossval(args, extra):
+    return run_script("crossval", extra)
+
+
+COMMANDS = {
+    "train": run_train,
+    "eval": run_eval,
+    "predict": run_predict,
+    "export": run_export,
+    "bench": run_bench,
+    "sweep": run_sweep,
+    "crossval": run_crossval,
+}
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Digit recognizer.")
+    parser.add_argument(
+        "--import-report",
+        action="store_true",
+        help="print how long imports took when the command ends",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    # These subcommands pass their options on to their own modules.
+    subparsers.add_parser(
+        "train", add_help=False, help="train model. see train --help"
+    )
+    subparsers.add_parser(
+        "bench", add_help=False, help="run benchmarks. see bench --help"
+    )
+    subparsers.add_parser(
+        "sweep", add_help=False, help="search hyperparameters. see sweep --help"
+    )
+    subparsers.add_parser(
+        "crossval", add_help=False, help="k-fold cross-validation. see crossval --help"
+    )
+
+    eval_parser = subparsers.add_parser(
+        "eval", help="evaluate weights on the validation rows"
+    )
+    eval_parser.add_argument("--weights", default=WEIGHTS_PATH)
+    eval_parser.add_argument(
+        "--architecture", choices=ARCHITECTURE_NAMES, default=ARCHITECTURE
+    )
+    eval_parser.add_argument("--train-path", default=TRAIN_DATA_PATH)
+    eval_parser.add_argument("--validation-num", type=int, default=VALIDATION_NUM)
+    eval_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    predict_parser = subparsers.add_parser(
+        "predict", help="write kaggle submission"
+    )
+    predict_parser.add_argument("--weights", default=WEIGHTS_PATH)
+    predict_parser.add_argument(
+        "--architecture", choices=ARCHITECTURE_NAMES, default=ARCHITECTURE
+    )
+    predict_parser.add_argument("--test-path", default=TEST_DATA_PATH)
+    predict_parser.add_argument("--output", default=SUBMISSION_PATH)
+    predict_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    export_parser = subparsers.add_parser(
+        "export", help="export weights for numpy_model or tflite"
+    )
+    export_parser.add_argument("--weights", default=WEIGHTS_PATH)
+    export_parser.add_argument(
+        "--architecture", choices=ARCHITECTURE_NAMES, default=ARCHITECTURE
+    )
+    export_parser.add_argument("--format", choices=EXPORT_FORMATS, default="npz")
+    export_parser.add_argument(
+        "--output",
+        help="default is {} for npz, {} for tflite and {} for int8".format(
+            NPZ_PATH, TFLITE_PATH, INT8_TFLITE_PATH
+        ),
+    )
+    export_parser.add_argument(
+        "--train-path",
+        default=TRAIN_DATA_PATH,
+        help="calibration data of int8 export",
+    )
+    export_parser.add_argument(
+        "--validation-num",
+        type=int,
+        default=VALIDATION_NUM,
+        help="first rows of --train-path left out of int8 calibration",
+    )
+
+    return parser
+
+
+if __name__ == "__main__":
+    args, extra = make_parser().parse_known_args()
+    if extra and args.command not in ("train", "bench", "sweep", "crossval"):
+        make_parser().error("unrecognized arguments: {}".format(" ".join(extra)))
+
+    try:
+        status = COMMANDS[args.command](args, extra)
+    finally:
+        if args.import_report:
+            print_import_report()
+    sys.exit(status)
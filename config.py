@@ -0,0 +1,21 @@
+"""Paths and data split shared by every command.
+
+Only constants live here, so importing this module stays as cheap as
+importing the standard library.
+"""
+
+
+TRAIN_DATA_PATH = "./data/train.csv"
+TEST_DATA_PATH = "./data/test.csv"
+SUBMISSION_PATH = "./data/submission.csv"
+WEIGHTS_PATH = "./data/model.weights.h5"
+METRICS_LOG_PATH = "./data/metrics.jsonl"
+NPZ_PATH = "./data/model.npz"
+TFLITE_PATH = "./data/model.tflite"
+INT8_TFLITE_PATH = "./data/model_int8.tflite"
+# Key of model.ARCHITECTURES trained and loaded by default.
+ARCHITECTURE = "baseline"
+# Keys of model.ARCHITECTURES, for command lines that do not import tensorflow.
+ARCHITECTURE_NAMES = ("baseline", "pooled", "strided", "separable")
+# Number of first rows of train.csv held out for validation.
+VALIDATION_NUM = 2000
@@ -0,0 +1,292 @@
+"""Module for k-fold cross-validation with folds trained in parallel processes."""
+import os
+import json
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sweep import init_worker
+from config import TRAIN_DATA_PATH
+
+
+RESULTS_PATH = "./data/crossval.json"
+NUM_FOLDS = 5
+EPOCHS = 10
+SEED = 0
+METRICS = ("train_loss", "train_accuracy", "validation_loss", "validation_accuracy")
+
+
+def make_folds(label, num_folds=NUM_FOLDS, seed=SEED):
+    """
+    Assign every row to a fold, keeping the share of each digit equal across folds.
+
+    Parameters
+    ----------
+        label : ndarray
+        num_folds : int
+        seed : int
+
+    Returns
+    -------
+        folds : ndarray
+            int8 fold index of every row.
+    """
+    rng = np.random.default_rng(seed)
+    folds = np.empty(len(label), np.int8)
+    offset = 0
+    for digit in np.unique(label):
+        rows = rng.permutation(np.flatnonzero(label == digit))
+        # Continue where the last digit stopped, so fold sizes stay even.
+        folds[rows] = (np.arange(len(rows)) + offset) % num_folds
+        offset += len(rows)
+    return folds
+
+
+def share_arrays(arrays):
+    """
+    Copy arrays into one block of shared memory.
+
+    Parameters
+    ----------
+        arrays : dict of ndarray
+
+    Returns
+    -------
+        memory : multiprocessing.shared_memory.SharedMemory
+            close and unlink it when every process is done.
+        spec : list of tuple
+            (name, shape, dtype, offset) of every array, for attach_arrays.
+    """
+    spec = []
+    size = 0
+    for name, array in arrays.items():
+        spec.append((name, array.shape, array.dtype.str, size))
+        # Keep every array 64-byte aligned.
+        size += -(-array.nbytes // 64) * 64
+    memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for name, shape, dtype, offset in spec:
+        view = np.ndarray(shape, dtype, memory.buf, offset)
+        view[...] = arrays[name]
+    return memory, spec
+
+
+def attach_arrays(memory_name, spec):
+    """
+    Map arrays written by share_arrays without copying them.
+
+    Parameters
+    ----------
+        memory_name : string
+        spec : list of tuple
+
+    Returns
+    -------
+        memory : multiprocessing.shared_memory.SharedMemory
+            keep it referenced while the arrays are used.
+        arrays : dict of ndarray
+    """
+    memory = shared_memory.SharedMemory(name=memory_name)
+    arrays = {
+        name: np.ndarray(shape, dtype, memory.buf, offset)
+        for name, shape, dtype, offset in spec
+    }
+    return memory, arrays
+
+
+def run_fold(memory_name, spec, fold, params, epochs):
+    """
+    Train on every fold but fold and validate on fold.
+
+    Parameters
+    ----------
+        memory_name : string
+        spec : list of tuple
+            written by share_arrays, with features, label and folds.
+        fold : int
+        params : dict
+            keyword arguments of main.build_training.
+        epochs : int
+
+    Returns
+    -------
+        result : dict
+            losses and accuracies of the last epoch.
+    """
+    import main
+    from utils import get_memmap_dataset
+
+    # memory stays referenced until the datasets reading it are gone.
+    memory, arrays = attach_arrays(memory_name, spec)
+    features, label, folds = arrays["features"], arrays["label"], arrays["folds"]
+    batch_size = params.get("batch_size", main.BATCH_SIZE)
+
+    train_dataset = get_memmap_dataset(
+        features, label, batch_size, indices=np.flatnonzero(folds != fold)
+    )
+    validation_dataset = get_memmap_dataset(
+        features,
+        label,
+        batch_size,
+        shuffle=False,
+        indices=np.flatnonzero(folds == fold),
+    )
+
+    model, loss_object, optimizer, metrics_loss, metrics_accuracy = (
+        main.build_training(**params)
+    )
+    record = main.train(
+        train_dataset,
+        validation_dataset,
+        model,
+        loss_object,
+        optimizer,
+        epochs,
+        metrics_loss,
+        metrics_accuracy,
+        metrics_loss,
+        metrics_accuracy,
+        steps_per_execution=main.STEPS_PER_EXECUTION,
+    )
+
+    return {name: record[name] for name in METRICS}
+
+
+def aggregate(results):
+    """
+    Mean and standard deviation of every metric over folds.
+
+    Parameters
+    ----------
+        results : list of dict
+            returned by run_fold.
+
+    Returns
+    -------
+        summary : dict
+            name: {"mean": float, "std": float}
+    """
+    return {
+        name: {
+            "mean": float(np.mean([result[name] for result in results])),
+            "std": float(np.std([result[name] for result in results])),
+        }
+        for name in METRICS
+    }
+
+
+def cross_validate(
+    path=TRAIN_DATA_PATH,
+    num_folds=NUM_FOLDS,
+    epochs=EPOCHS,
+    params=None,
+    workers=None,
+    threads=None,
+    seed=SEED,
+):
+    """
+    Train num_folds models at the same time and aggregate their metrics.
+
+    Parameters
+    ----------
+        path : string
+            path of the train data(csv).
+        num_folds : int
+        epochs : int
+        params : dict or None
+            keyword arguments of main.build_training.
+        workers : int or None
+            number of worker processes. default is one per fold, at most one
+            per cpu.
+        threads : int or None
+            number of cpus of each worker.
+        seed : int
+            seed of the fold assignment.
+
+    Returns
+    -------
+        results : list of dict
+            metrics of every fold.
+        summary : dict
+            returned by aggregate.
+    """
+    from utils import get_data
+
+    features, label = get_data(path)
+    folds = make_folds(label, num_folds, seed)
+
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    num_cpus = len(cpus) or os.cpu_count() or 1
+    workers = workers or max(1, min(num_folds, num_cpus))
+    threads = threads or max(1, num_cpus // workers)
+
+    memory, spec = share_arrays({"features": features, "label": label, "folds": folds})
+    try:
+        context = multiprocessing.get_context("spawn")
+        cpu_slices = context.Queue()
+        for worker in range(workers):
+            cpu_slices.put(cpus[worker * threads : (worker + 1) * threads])
+
+        with ProcessPoolExecutor(
+            workers,
+            mp_context=context,
+            initializer=init_worker,
+            initargs=(cpu_slices, threads),
+        ) as pool:
+            futures = [
+                pool.submit(run_fold, memory.name, spec, fold, params or {}, epochs)
+                for fold in range(num_folds)
+            ]
+            results = [future.result() for future in futures]
+    finally:
+        memory.close()
+        memory.unlink()
+
+    return results, aggregate(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-validate model.")
+    parser.add_argument("--train-path", default=TRAIN_DATA_PATH)
+    parser.add_argument("--folds", type=int, default=NUM_FOLDS)
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--learning-rate", type=float)
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--threads", type=int, help="cpus per worker")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--output", default=RESULTS_PATH)
+    args = parser.parse_args()
+
+    params_ = {}
+    if args.learning_rate is not None:
+        params_["learning_rate"] = args.learning_rate
+    if args.batch_size is not None:
+        params_["batch_size"] = args.batch_size
+
+    results_, summary_ = cross_validate(
+        args.train_path,
+        args.folds,
+        args.epochs,
+        params_,
+        args.workers,
+        args.threads,
+        args.seed,
+    )
+
+    print("{:<6}{:>12}{:>12}".format("fold", "val_loss", "val_acc"))
+    for fold_, result_ in enumerate(results_):
+        print(
+            "{:<6}{:>12.4f}{:>12.4f}".format(
+                fold_, result_["validation_loss"], result_["validation_accuracy"]
+            )
+        )
+    for name_ in ("validation_loss", "validation_accuracy"):
+        print(
+            "{}: {:.4f} +- {:.4f}".format(
+                name_, summary_[name_]["mean"], summary_[name_]["std"]
+            )
+        )
+
+    with open(args.output, "w") as f:
+        json.dump({"folds": results_, "summary": summary_}, f, indent=1)
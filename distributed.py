@@ -0,0 +1,338 @@
+"""Module for data-parallel training with worker processes on one machine."""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import numpy as np
+from config import TRAIN_DATA_PATH
+from config import VALIDATION_NUM
+from config import ARCHITECTURE
+from config import ARCHITECTURE_NAMES
+
+
+EPOCHS = 2
+LEARNING_RATE = 0.01
+BATCH_SIZE = 16
+
+
+def get_free_ports(num):
+    """
+    Find free tcp ports on localhost.
+
+    Parameters
+    ----------
+        num : int
+
+    Returns
+    -------
+        ports : list of int
+    """
+    sockets = []
+    for _ in range(num):
+        s = socket.socket()
+        s.bind(("localhost", 0))
+        sockets.append(s)
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+
+def make_tf_config(ports, index):
+    """
+    Make TF_CONFIG of a worker in a localhost cluster.
+
+    Parameters
+    ----------
+        ports : list of int
+            one port per worker.
+        index : int
+            index of the worker.
+
+    Returns
+    -------
+        tf_config : string
+    """
+    cluster = {"worker": ["localhost:{}".format(port) for port in ports]}
+    return json.dumps({"cluster": cluster, "task": {"type": "worker", "index": index}})
+
+
+def load_features(path, synthetic):
+    """
+    Load features and label, or make random ones of MNIST shape.
+
+    Parameters
+    ----------
+        path : string
+            path of the data(csv).
+        synthetic : int
+            number of random rows to make instead of loading path. 0 to load path.
+
+    Returns
+    -------
+        features : ndarray
+        label : ndarray
+    """
+    if synthetic:
+        rng = np.random.default_rng(0)
+        features = rng.integers(0, 256, (synthetic, 28, 28, 1), dtype=np.uint8)
+        label = rng.integers(0, 10, synthetic, dtype=np.uint8)
+        return features, label
+
+    from utils import get_data
+
+    return get_data(path)
+
+
+def run_worker(args):
+    """
+    Train model with MultiWorkerMirroredStrategy as one worker of the cluster.
+
+    TF_CONFIG must be set before this is called. The chief (worker 0) prints
+    one json line with the measured throughput.
+
+    Parameters
+    ----------
+        args : argparse.Namespace
+    """
+    import tensorflow as tf
+    from main import build_training
+    from training import make_train_step
+    from training import train_epoch
+    from validation import make_eval_step
+    from validation import test_epoch
+    from utils import get_dataset
+    from utils import split_validation
+
+    # Share the cores of the machine between workers.
+    threads = max(1, (os.cpu_count() or 1) // args.num_workers)
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    task = json.loads(os.environ["TF_CONFIG"])["task"]
+    num_workers = strategy.num_replicas_in_sync
+
+    # Every worker feeds batch_size rows of its own shard per step.
+    global_batch_size = args.batch_size * num_workers
+
+    with strategy.scope():
+        # The learning rate is scaled to the global batch like in main.py.
+        model, loss_object, optimizer, metrics_loss, metrics_accuracy = (
+            build_training(
+                learning_rate=args.learning_rate,
+                batch_size=global_batch_size,
+                architecture=args.architecture,
+            )
+        )
+
+    features, label = load_features(args.path, args.synthetic)
+    (
+        train_features,
+        train_label,
+        validation_features,
+        validation_label,
+    ) = split_validation(features, label, args.validation_num)
+
+    # Datasets built per input pipeline are taken as they are, while
+    # experimental_distribute_dataset would split each batch across replicas.
+    def make_dataset_fn(features, label, shuffle):
+        def dataset_fn(input_context):
+            return get_dataset(
+                features,
+                label,
+                input_context.get_per_replica_batch_size(global_batch_size),
+                shuffle=shuffle,
+                num_shards=input_context.num_input_pipelines,
+                shard_index=input_context.input_pipeline_id,
+            )
+
+        return dataset_fn
+
+    train_dataset = strategy.distribute_datasets_from_function(
+        make_dataset_fn(train_features, train_label, True)
+    )
+    validation_dataset = strategy.distribute_datasets_from_function(
+        make_dataset_fn(validation_features, validation_label, False)
+    )
+
+    train_step = make_train_step(
+        model,
+        loss_object,
+        optimizer,
+        metrics_loss,
+        metrics_accuracy,
+        args.steps_per_execution,
+        strategy,
+    )
+    eval_step = make_eval_step(
+        model,
+        loss_object,
+        metrics_loss,
+        metrics_accuracy,
+        args.steps_per_execution,
+        strategy=strategy,
+    )
+
+    images = (len(train_label) // num_workers) * num_workers
+    for epoch in range(1, args.epochs + 1):
+        start = time.perf_counter()
+        train_loss, train_accuracy = train_epoch(
+            train_dataset,
+            train_step,
+            metrics_loss,
+            metrics_accuracy,
+            args.steps_per_execution,
+        )
+        seconds = time.perf_counter() - start
+        validation_loss, validation_accuracy = test_epoch(
+            validation_dataset,
+            eval_step,
+            metrics_loss,
+            metrics_accuracy,
+            args.steps_per_execution,
+        )
+
+        if task["index"] == 0:
+            record = {
+                "workers": num_workers,
+                "epoch": epoch,
+                "seconds": seconds,
+                "images_per_second": images / seconds,
+                "train_loss": train_loss,
+                "train_accuracy": train_accuracy,
+                "validation_loss": validation_loss,
+                "validation_accuracy": validation_accuracy,
+            }
+            print(json.dumps(record), flush=True)
+
+
+def launch(num_workers, worker_args, path=None):
+    """
+    Start num_workers local worker processes and wait for them.
+
+    Parameters
+    ----------
+        num_workers : int
+        worker_args : list of string
+            command line arguments passed to every worker.
+        path : string or None
+            train data(csv) cached before workers start, so they do not race
+            to write the cache. None if workers make synthetic data.
+
+    Returns
+    -------
+        records : list of dict
+            records printed by the chief, one per epoch.
+    """
+    if path is not None:
+        from utils import get_data
+
+        get_data(path)
+
+    ports = get_free_ports(num_workers)
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ, TF_CONFIG=make_tf_config(ports, index))
+        command = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--worker",
+            "--num-workers",
+            str(num_workers),
+        ]
+        command += worker_args
+        processes.append(
+            subprocess.Popen(
+                command,
+                env=env,
+                stdout=subprocess.PIPE if index == 0 else subprocess.DEVNULL,
+                text=True,
+            )
+        )
+
+    output, _ = processes[0].communicate()
+    for process in processes[1:]:
+        process.wait()
+    if any(process.returncode != 0 for process in processes):
+        raise RuntimeError("worker failed with {} workers".format(num_workers))
+
+    return [json.loads(line) for line in output.splitlines() if line.startswith("{")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Data-parallel training.")
+    parser.add_argument("--path", default=TRAIN_DATA_PATH)
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--validation-num", type=int, default=VALIDATION_NUM)
+    parser.add_argument(
+        "--learning-rate",
+        type=float,
+        default=LEARNING_RATE,
+        help="learning rate at main.BASE_BATCH_SIZE, scaled to the global batch",
+    )
+    parser.add_argument(
+        "--architecture", choices=ARCHITECTURE_NAMES, default=ARCHITECTURE
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=BATCH_SIZE, help="batch size per worker"
+    )
+    parser.add_argument("--steps-per-execution", type=int, default=1)
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=0,
+        help="train on this many random rows instead of path",
+    )
+    parser.add_argument("--num-workers", type=int, default=2)
+    parser.add_argument(
+        "--benchmark",
+        type=int,
+        nargs="*",
+        help="report throughput for each number of workers, e.g. 1 2 4 8",
+    )
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        sys.exit(0)
+
+    worker_args = [
+        "--path",
+        args.path,
+        "--epochs",
+        str(args.epochs),
+        "--validation-num",
+        str(args.validation_num),
+        "--learning-rate",
+        str(args.learning_rate),
+        "--architecture",
+        args.architecture,
+        "--batch-size",
+        str(args.batch_size),
+        "--steps-per-execution",
+        str(args.steps_per_execution),
+        "--synthetic",
+        str(args.synthetic),
+    ]
+    path = None if args.synthetic else args.path
+    if args.benchmark is None:
+        for record in launch(args.num_workers, worker_args, path):
+            print(record)
+    else:
+        # The last epoch is reported, so the first one absorbs tracing cost.
+        base = None
+        for num_workers in args.benchmark or [1, 2, 4, 8]:
+            record = launch(num_workers, worker_args, path)[-1]
+            base = base or record["images_per_second"]
+            print(
+                "{:>2} workers: {:>9.0f} images/sec, {:.2f}x".format(
+                    num_workers,
+                    record["images_per_second"],
+                    record["images_per_second"] / base,
+                )
+            )
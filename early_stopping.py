@@ -0,0 +1,173 @@
+"""Module for stopping training when validation metrics stop improving."""
+import numpy as np
+
+
+MONITORS = ("validation_loss", "validation_accuracy")
+PATIENCE = 10
+MIN_DELTA = 0.0
+
+
+class EarlyStopping:
+    """
+    A class to decide after every epoch whether training should stop.
+
+    Training stops when monitor has not improved by more than min_delta for
+    patience epochs, or when validation accuracy reaches target_accuracy.
+
+    Attributes
+    ----------
+        monitor : string or None
+            one of MONITORS. None to stop on target_accuracy only.
+        patience : int
+        min_delta : float
+        target_accuracy : float or None
+        restore_best : boolean
+            whether restore_best_weights puts back the weights of the best epoch.
+        best : float or None
+            best value of monitor.
+        best_epoch : int or None
+        best_weights : list of ndarray or None
+        stopped_epoch : int or None
+        reason : string or None
+            "patience" or "target" once stopped.
+        target_epoch : int or None
+            first epoch reaching target_accuracy.
+        time_to_target : float or None
+            seconds of training until target_epoch.
+
+    Methods
+    -------
+        update(record, model):
+            return whether to stop after the epoch of record.
+        restore_best_weights(model):
+            set weights of the best epoch and return whether they changed.
+        describe():
+            return summary as one line of text.
+        summary():
+            return state as dict.
+    """
+
+    def __init__(
+        self,
+        monitor="validation_loss",
+        patience=PATIENCE,
+        min_delta=MIN_DELTA,
+        target_accuracy=None,
+        restore_best=True,
+    ):
+        if monitor is not None and monitor not in MONITORS:
+            raise ValueError(
+                "monitor must be one of {}, got {}".format(MONITORS, monitor)
+            )
+        self.monitor = monitor
+        self.patience = patience
+        self.min_delta = min_delta
+        self.target_accuracy = target_accuracy
+        self.restore_best = restore_best
+        self.best = None
+        self.best_epoch = None
+        self.best_weights = None
+        self.wait = 0
+        self.stopped_epoch = None
+        self.reason = None
+        self.target_epoch = None
+        self.time_to_target = None
+
+    def improved(self, value):
+        if self.best is None:
+            return True
+        if self.monitor == "validation_loss":
+            return value < self.best - self.min_delta
+        return value > self.best + self.min_delta
+
+    def update(self, record, model):
+        """
+        Check metrics of a finished epoch.
+
+        Parameters
+        ----------
+            record : dict
+                epoch record of main.train, with elapsed seconds.
+            model : tf.keras.Model
+
+        Returns
+        -------
+            stop : boolean
+        """
+        epoch = record["epoch"]
+
+        if (
+            self.target_accuracy is not None
+            and self.target_epoch is None
+            and record["validation_accuracy"] >= self.target_accuracy
+        ):
+            self.target_epoch = epoch
+            self.time_to_target = record["elapsed"]
+            self.stopped_epoch = epoch
+            self.reason = "target"
+            return True
+
+        if self.monitor is None:
+            return False
+
+        value = record[self.monitor]
+        if self.improved(value):
+            self.best = value
+            self.best_epoch = epoch
+            self.wait = 0
+            if self.restore_best:
+                self.best_weights = [np.copy(weight) for weight in model.get_weights()]
+            return False
+
+        self.wait += 1
+        if self.wait >= self.patience:
+            self.stopped_epoch = epoch
+            self.reason = "patience"
+            return True
+        return False
+
+    def restore_best_weights(self, model):
+        # Reaching the target makes the last epoch the one to keep.
+        if self.reason == "target":
+            return False
+        if self.restore_best and self.best_weights is not None:
+            model.set_weights(self.best_weights)
+            return True
+        return False
+
+    def describe(self):
+        parts = []
+        if self.reason is None:
+            parts.append("ran every epoch")
+        else:
+            parts.append(
+                "stopped at epoch {} ({})".format(self.stopped_epoch, self.reason)
+            )
+        if self.best_epoch is not None:
+            parts.append(
+                "best {} {:.4f} at epoch {}".format(
+                    self.monitor, self.best, self.best_epoch
+                )
+            )
+        if self.target_accuracy is not None:
+            if self.target_epoch is None:
+                parts.append("accuracy {} not reached".format(self.target_accuracy))
+            else:
+                parts.append(
+                    "accuracy {} reached at epoch {} after {:.1f}s".format(
+                        self.target_accuracy, self.target_epoch, self.time_to_target
+                    )
+                )
+        return ", ".join(parts)
+
+    def summary(self):
+        return {
+            "monitor": self.monitor,
+            "best": self.best,
+            "best_epoch": self.best_epoch,
+            "stopped_epoch": self.stopped_epoch,
+            "reason": self.reason,
+            "target_accuracy": self.target_accuracy,
+            "target_epoch": self.target_epoch,
+            "time_to_target": self.time_to_target,
+        }
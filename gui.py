@@ -9,21 +9,38 @@ from PyQt5.QtWidgets import QApplication
 from PyQt5.QtCore import Qt
 from PyQt5.QtCore import QTimer
 from PyQt5.QtCore import pyqtSlot
+from PyQt5.QtCore import pyqtSignal
+import numpy as np
 import pyqtgraph
 from pyqtgraph.Qt import QtGui
 from pyqtgraph.Qt import QtCore
+from buffers import RingBuffer
+from buffers import downsample_minmax
+
+
+MAX_FPS = 30
+HISTORY_SIZE = 100000
+SAMPLE_HISTORY_SIZE = 100
+MAX_PLOT_POINTS = 2000
 
 
 class Main(QWidget):
+    # Carries metric records from the training thread to the gui thread.
+    metrics_received = pyqtSignal(dict)
+
     def __init__(self):
         super().__init__()
 
-        # Define variables for saving metrics.
-        self.epoch = []
-        self.train_accuracy = []
-        self.train_loss = []
-        self.validation_accuracy = []
-        self.validation_loss = []
+        # Define fixed-size buffers for saving metrics.
+        self.epoch = RingBuffer(HISTORY_SIZE)
+        self.train_accuracy = RingBuffer(HISTORY_SIZE)
+        self.train_loss = RingBuffer(HISTORY_SIZE)
+        self.validation_accuracy = RingBuffer(HISTORY_SIZE)
+        self.validation_loss = RingBuffer(HISTORY_SIZE)
+        self.sample_image = RingBuffer(SAMPLE_HISTORY_SIZE, (28, 28), np.uint8)
+        self.sample_label = RingBuffer(SAMPLE_HISTORY_SIZE, dtype=np.int64)
+        self.sample_prediction = RingBuffer(SAMPLE_HISTORY_SIZE, dtype=np.int64)
+        self.dirty = False
 
         # Create layout.
         hbox1 = QHBoxLayout()
@@ -233,34 +250,69 @@ class Main(QWidget):
         self.validation_accuracy_graph.enableAutoRange(axis="y")
         self.validation_loss_graph.enableAutoRange(axis="y")
 
+        # Queued connection, so records emitted by other threads are received here.
+        self.metrics_received.connect(self.receive_metrics)
+
+        # Redraw at most MAX_FPS times per second and only when there is new data.
         self.timer = QTimer()
-        self.timer.setInterval(1)
-        self.timer.timeout.connect(self.update)
+        self.timer.setInterval(1000 // MAX_FPS)
+        self.timer.timeout.connect(self.redraw)
         self.timer.start()
 
         self.show()
 
+    @pyqtSlot(dict)
+    def receive_metrics(self, record):
+        self.epoch.append(record["epoch"])
+        self.train_accuracy.append(record["train_accuracy"])
+        self.train_loss.append(record["train_loss"])
+        self.validation_accuracy.append(record["validation_accuracy"])
+        self.validation_loss.append(record["validation_loss"])
+        self.sample_image.append(record["sample_image"])
+        self.sample_label.append(record["sample_label"])
+        self.sample_prediction.append(record["sample_prediction"])
+        self.dirty = True
+
     @pyqtSlot()
-    def update(self):
-        self.train_accuracy_curve.setData(self.epoch, self.train_accuracy)
-        self.train_loss_curve.setData(self.epoch, self.train_loss)
-        self.validation_accuracy_curve.setData(self.epoch, self.validation_accuracy)
-        self.validation_loss_curve.setData(self.epoch, self.validation_loss)
-
-        self.label_epoch.setText(str(self.epoch[-1]))
-        self.label_train_accuracy.setText(str(self.train_accuracy[-1]))
-        self.label_train_loss.setText(str(self.train_loss[-1]))
-        self.label_validation_accuracy.setText(str(self.validation_accuracy[-1]))
-        self.label_validation_loss.setText(str(self.validation_loss[-1]))
-
-    def update_metrics(
-        self, epoch, train_accuracy, train_loss, validation_accuracy, validation_loss
-    ):
-        self.epoch = epoch
-        self.train_accuracy = train_accuracy
-        self.train_loss = train_loss
-        self.validation_accuracy = validation_accuracy
-        self.validation_loss = validation_loss
+    def redraw(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+
+        # Plot at most MAX_PLOT_POINTS points per curve however long the history is.
+        epoch = self.epoch.values()
+        self.train_accuracy_curve.setData(
+            *downsample_minmax(epoch, self.train_accuracy.values(), MAX_PLOT_POINTS)
+        )
+        self.train_loss_curve.setData(
+            *downsample_minmax(epoch, self.train_loss.values(), MAX_PLOT_POINTS)
+        )
+        self.validation_accuracy_curve.setData(
+            *downsample_minmax(
+                epoch, self.validation_accuracy.values(), MAX_PLOT_POINTS
+            )
+        )
+        self.validation_loss_curve.setData(
+            *downsample_minmax(epoch, self.validation_loss.values(), MAX_PLOT_POINTS)
+        )
+
+        self.label_epoch.setText(str(int(self.epoch.last())))
+        self.label_train_accuracy.setText(str(self.train_accuracy.last()))
+        self.label_train_loss.setText(str(self.train_loss.last()))
+        self.label_validation_accuracy.setText(str(self.validation_accuracy.last()))
+        self.label_validation_loss.setText(str(self.validation_loss.last()))
+
+    def update_metrics(self, record):
+        """
+        Send metric record of one epoch to gui. Safe to call from any thread.
+
+        Parameters
+        ----------
+            record : dict
+                epoch, train_accuracy, train_loss, validation_accuracy,
+                validation_loss, sample_image, sample_label, sample_prediction.
+        """
+        self.metrics_received.emit(record)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+"""Module for predicting test data in batches and writing kaggle submission."""
+import csv
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+from model import build_model
+from utils import PIXEL_SCALE
+from utils import get_csv_lines
+from utils import get_csv_dataset
+from utils import get_data
+from utils import get_dataset
+from utils import split_validation
+from validation import make_eval_step
+from validation import test_epoch
+from config import TEST_DATA_PATH
+from config import SUBMISSION_PATH
+from config import WEIGHTS_PATH
+from config import VALIDATION_NUM
+from config import ARCHITECTURE
+
+
+BATCH_SIZE = 1024
+
+
+def make_predict_step(model):
+    """
+    Build a compiled function that predicts digits of a uint8 image batch.
+
+    Parameters
+    ----------
+        model : tf.keras.Model
+
+    Returns
+    -------
+        predict_step : tf.function
+            takes uint8 images of shape (, 28, 28, 1) and returns int32 labels.
+    """
+
+    @tf.function(
+        input_signature=[tf.TensorSpec(shape=(None, 28, 28, 1), dtype=tf.uint8)]
+    )
+    def predict_step(images):
+        images = tf.cast(images, tf.float32) / PIXEL_SCALE
+        predictions = model(images, training=False)
+        return tf.math.argmax(predictions, axis=-1, output_type=tf.int32)
+
+    return predict_step
+
+
+def load_model(weights_path, architecture=ARCHITECTURE):
+    """
+    Build model and load trained weights.
+
+    Parameters
+    ----------
+        weights_path : string
+            path of weights saved by model.save_weights.
+        architecture : string
+            key of model.ARCHITECTURES the weights were trained with.
+
+    Returns
+    -------
+        model : tf.keras.Model
+    """
+    model = build_model(architecture)
+    model(tf.zeros((1, 28, 28, 1)), training=False)
+    model.load_weights(weights_path)
+    return model
+
+
+def summarize_latency(num_images, total_time, latencies):
+    """
+    Summarize throughput and latency of batches.
+
+    Parameters
+    ----------
+        num_images : int
+        total_time : float
+            wall-clock seconds of the whole run.
+        latencies : list of float
+            seconds spent in each batch.
+
+    Returns
+    -------
+        stats : dict
+    """
+    latencies = np.asarray(latencies) * 1000.0
+    return {
+        "images": num_images,
+        "seconds": total_time,
+        "images_per_second": num_images / total_time if total_time > 0 else 0.0,
+        "p50_latency_ms": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+        "p99_latency_ms": float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+    }
+
+
+def evaluate(model, path, validation_num=VALIDATION_NUM, batch_size=BATCH_SIZE):
+    """
+    Compute loss and accuracy of model on the validation rows of labeled csv.
+
+    Parameters
+    ----------
+        model : tf.keras.Model
+            trained model.
+        path : string
+            path of the train data(csv).
+        validation_num : int
+            number of validation rows, as used during training.
+        batch_size : int
+
+    Returns
+    -------
+        loss : float
+        accuracy : float
+    """
+    features, label = get_data(path)
+    _, _, validation_features, validation_label = split_validation(
+        features, label, validation_num
+    )
+    dataset = get_dataset(
+        validation_features, validation_label, batch_size, shuffle=False
+    )
+
+    loss_object = tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True)
+    metrics_loss = tf.keras.metrics.Mean()
+    metrics_accuracy = tf.keras.metrics.SparseCategoricalAccuracy()
+    eval_step = make_eval_step(model, loss_object, metrics_loss, metrics_accuracy)
+    return test_epoch(dataset, eval_step, metrics_loss, metrics_accuracy)
+
+
+def predict(model, path, output_path, batch_size=BATCH_SIZE):
+    """
+    Predict every row of test csv and write ImageId,Label csv incrementally.
+
+    Parameters
+    ----------
+        model : tf.keras.Model
+            trained model.
+        path : string or list of string
+            path of the test data(csv).
+        output_path : string
+            path of the submission(csv).
+        batch_size : int
+
+    Returns
+    -------
+        stats : dict
+            images, seconds, images_per_second, p50_latency_ms, p99_latency_ms.
+            latency is the time spent in the compiled predict function per batch.
+    """
+    predict_step = make_predict_step(model)
+    dataset = get_csv_dataset(
+        get_csv_lines(path), batch_size, labeled=False, shuffle=False
+    )
+
+    latencies = []
+    image_id = 0
+    start = time.perf_counter()
+
+    with open(output_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ImageId", "Label"])
+
+        for images in dataset:
+            batch_start = time.perf_counter()
+            labels = predict_step(images).numpy()
+            latencies.append(time.perf_counter() - batch_start)
+
+            ids = np.arange(image_id + 1, image_id + len(labels) + 1)
+            writer.writerows(zip(ids.tolist(), labels.tolist()))
+            image_id += len(labels)
+
+    return summarize_latency(image_id, time.perf_counter() - start, latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write kaggle submission.")
+    parser.add_argument("--test-path", default=TEST_DATA_PATH)
+    parser.add_argument("--output", default=SUBMISSION_PATH)
+    parser.add_argument("--weights", default=WEIGHTS_PATH)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    stats = predict(
+        load_model(args.weights), args.test_path, args.output, args.batch_size
+    )
+    print(
+        "{images} images in {seconds:.2f}s, {images_per_second:.0f} images/sec, "
+        "p50 {p50_latency_ms:.2f}ms, p99 {p99_latency_ms:.2f}ms per batch".format(
+            **stats
+        )
+    )
@@ -1,29 +1,114 @@
 """Module for main.py"""
 import sys
+import time
+import argparse
 import threading
 import tensorflow as tf
 import numpy as np
-from PyQt5.QtWidgets import QApplication
-from model import Model
+from model import ARCHITECTURES
+from model import build_model
+from checkpoint import Checkpointer
+from early_stopping import EarlyStopping
+from early_stopping import MONITORS
+from metrics_log import MetricsLog
+from profiling import make_profiled_train_step
+from profiling import null_phase
+from profiling import profiled_train_epoch
+from profiling import PhaseProfiler
+from training import make_learning_rate
+from training import make_optimizer
+from training import make_train_step
+from training import set_precision
 from training import train_epoch
+from validation import make_eval_step
 from validation import test_epoch
-from validation import sample_test
+from validation import ValidationSampler
 from utils import get_train_dataset
-from gui import Main
+from config import TRAIN_DATA_PATH
+from config import WEIGHTS_PATH
+from config import METRICS_LOG_PATH
+from config import VALIDATION_NUM
+from config import ARCHITECTURE
 
 
-TRAIN_DATA_PATH = "./data/train.csv"
+CHECKPOINT_DIR = "./data/checkpoints"
+LOG_EVERY = 100
 EPOCHS = 100
-VALIDATION_NUM = 2000
 LEARNING_RATE = 0.01
 BATCH_SIZE = 16
+# Large-batch mode: LEARNING_RATE is tuned for BASE_BATCH_SIZE and scaled to
+# BATCH_SIZE * ACCUMULATION_STEPS, e.g. BATCH_SIZE = 1024 with LR_SCALING = "sqrt".
+BASE_BATCH_SIZE = 16
+LR_SCALING = "sqrt"
+WARMUP_STEPS = 0
+ACCUMULATION_STEPS = 1
+STEPS_PER_EXECUTION = 1
+STREAMING = False
+AUGMENT = False
+SEED = None
+PRECISION = "float32"
+JIT_COMPILE = False
+LOSS_SCALE = False
+PROFILE = False
+PROFILE_TRACE_STEPS = None
+PROFILE_LOG_DIR = "./data/profile"
+EARLY_STOPPING = None
+PATIENCE = 10
+TARGET_ACCURACY = None
 
-model_ = Model()
-loss_object_ = tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True)
-optimzer_ = tf.keras.optimizers.Adam(LEARNING_RATE)
 
-metrics_loss = tf.keras.metrics.Mean()
-metrics_accuracy = tf.keras.metrics.SparseCategoricalAccuracy()
+def build_training(
+    precision=PRECISION,
+    learning_rate=LEARNING_RATE,
+    batch_size=BATCH_SIZE,
+    loss_scale=LOSS_SCALE,
+    accumulation_steps=ACCUMULATION_STEPS,
+    architecture=ARCHITECTURE,
+):
+    """
+    Construct model, loss, optimizer and metrics on demand.
+
+    Parameters
+    ----------
+        precision : string
+            one of training.PRECISION_POLICIES. set before the model is built.
+        learning_rate : float
+            learning rate at BASE_BATCH_SIZE.
+        batch_size : int
+        loss_scale : boolean
+        accumulation_steps : int
+        architecture : string
+            key of model.ARCHITECTURES.
+
+    Returns
+    -------
+        model : tf.keras.Model
+        loss_object : tf.keras.losses
+        optimizer : tf.keras.optimizers
+        metrics_loss : tf.keras.metrics.Mean
+        metrics_accuracy : tf.keras.metrics.SparseCategoricalAccuracy
+    """
+    set_precision(precision)
+
+    model = build_model(architecture)
+    loss_object = tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True)
+    optimizer = make_optimizer(
+        make_learning_rate(
+            learning_rate,
+            batch_size,
+            BASE_BATCH_SIZE,
+            LR_SCALING,
+            WARMUP_STEPS,
+            accumulation_steps,
+        ),
+        loss_scale,
+        accumulation_steps,
+    )
+
+    metrics_loss = tf.keras.metrics.Mean()
+    metrics_accuracy = tf.keras.metrics.SparseCategoricalAccuracy()
+
+    return model, loss_object, optimizer, metrics_loss, metrics_accuracy
 
 
 def train(
@@ -38,86 +123,329 @@ def train(
     validation_metrics_loss,
     validation_metrics_accuracy,
     gui=None,
+    steps_per_execution=1,
+    weights_path=None,
+    checkpointer=None,
+    initial_epoch=0,
+    initial_elapsed=0.0,
+    metrics_log=None,
+    log_every=0,
+    jit_compile=False,
+    profiler=None,
+    early_stopping=None,
 ):
-    epoch_list = []
-    train_loss = []
-    train_accuracy = []
-    validation_loss = []
-    validation_accuracy = []
-    sample_image_list = []
-    sample_label_list = []
-    sample_prediction_list = []
-
-    tf.config.run_functions_eagerly(True)
-
-    for epoch in range(1, epochs + 1):
-        train_loss_new, train_accuracy_new = train_epoch(
-            train_data_loader,
+    if profiler is not None and (jit_compile or steps_per_execution > 1):
+        raise ValueError(
+            "profiler times single uncompiled steps, "
+            "set jit_compile=False and steps_per_execution=1"
+        )
+
+    train_step = make_train_step(
+        model,
+        loss_object,
+        optimzer,
+        train_metrics_loss,
+        train_metrics_accuracy,
+        steps_per_execution,
+        jit_compile=jit_compile,
+    )
+    sampler = ValidationSampler()
+    eval_step = make_eval_step(
+        model,
+        loss_object,
+        validation_metrics_loss,
+        validation_metrics_accuracy,
+        steps_per_execution,
+        sampler,
+        jit_compile=jit_compile,
+    )
+
+    if profiler is not None:
+        # Phases of the step are compiled apart so each one can be timed.
+        profiled_step = make_profiled_train_step(
             model,
             loss_object,
             optimzer,
             train_metrics_loss,
             train_metrics_accuracy,
         )
-        validation_loss_new, validation_accuracy_new = test_epoch(
-            test_data_loader,
-            model,
-            loss_object,
-            validation_metrics_loss,
-            validation_metrics_accuracy,
-        )
+        phase = profiler.phase
+    else:
+        phase = null_phase
 
-        sample_image, sample_label, sample_prediction = sample_test(
-            test_data_loader, model
+    step_count = [0]
+
+    def log_step(num_steps):
+        # Reading metrics waits for the step, so only do it every log_every steps.
+        previous = step_count[0]
+        step_count[0] += num_steps
+        if metrics_log is None or log_every <= 0:
+            return
+        if step_count[0] // log_every == previous // log_every:
+            return
+        metrics_log.update_metrics(
+            {
+                "type": "step",
+                "epoch": epoch,
+                "step": step_count[0],
+                "train_loss": float(train_metrics_loss.result()),
+                "train_accuracy": float(train_metrics_accuracy.result()),
+            }
         )
 
-        epoch_list.append(epoch)
-        train_loss.append(train_loss_new)
-        train_accuracy.append(train_accuracy_new)
-        validation_loss.append(validation_loss_new)
-        validation_accuracy.append(validation_accuracy_new)
-        temp_sample_image = tf.squeeze(sample_image).numpy()
-        temp_sample_image = temp_sample_image * 255
-        sample_image_list.append(temp_sample_image.astype(np.uint8))
-        sample_label_list.append(sample_label)
-        sample_prediction_list.append(sample_prediction)
-        if gui is not None:
-            gui.update_metrics(
-                epoch_list,
-                train_accuracy,
-                train_loss,
-                validation_accuracy,
-                validation_loss,
-                sample_image_list,
-                sample_label_list,
-                sample_prediction_list,
+    on_step = log_step if metrics_log is not None and log_every > 0 else None
+
+    # Elapsed time continues from the run a checkpoint was saved in.
+    start = time.perf_counter() - initial_elapsed
+    record = None
+    for epoch in range(initial_epoch + 1, epochs + 1):
+        if profiler is not None:
+            train_loss_new, train_accuracy_new, _ = profiled_train_epoch(
+                train_data_loader,
+                profiled_step,
+                train_metrics_loss,
+                train_metrics_accuracy,
+                profiler,
+                step_count[0],
+                log_step,
             )
         else:
-            pass
+            train_loss_new, train_accuracy_new = train_epoch(
+                train_data_loader,
+                train_step,
+                train_metrics_loss,
+                train_metrics_accuracy,
+                steps_per_execution,
+                on_step,
+            )
+        with phase("validation"):
+            validation_loss_new, validation_accuracy_new = test_epoch(
+                test_data_loader,
+                eval_step,
+                validation_metrics_loss,
+                validation_metrics_accuracy,
+                steps_per_execution,
+                sampler,
+            )
 
+        with phase("sampling"):
+            sample_images, sample_labels, sample_predictions = sampler.result()
+
+        temp_sample_image = np.squeeze(sample_images[0])
+        temp_sample_image = temp_sample_image * 255
+        record = {
+            "type": "epoch",
+            "epoch": epoch,
+            "elapsed": time.perf_counter() - start,
+            "train_loss": train_loss_new,
+            "train_accuracy": train_accuracy_new,
+            "validation_loss": validation_loss_new,
+            "validation_accuracy": validation_accuracy_new,
+            "sample_image": temp_sample_image.astype(np.uint8),
+            "sample_label": int(sample_labels[0]),
+            "sample_prediction": int(sample_predictions[0]),
+        }
+        with phase("gui"):
+            if gui is not None:
+                gui.update_metrics(record)
+            else:
+                pass
+        with phase("metrics_log"):
+            if metrics_log is not None:
+                metrics_log.update_metrics(record)
+
+        with phase("checkpoint"):
+            if checkpointer is not None:
+                checkpointer.save(epoch, record["elapsed"])
+
+        if profiler is not None:
+            print("epoch {} profile".format(epoch))
+            print(profiler.summary(), flush=True)
+            if metrics_log is not None:
+                profile_record = {"type": "profile", "epoch": epoch}
+                profile_record.update(profiler.as_dict())
+                metrics_log.update_metrics(profile_record)
+            profiler.reset()
+
+        if early_stopping is not None and early_stopping.update(record, model):
+            break
+
+    if profiler is not None:
+        profiler.stop_trace()
+
+    if early_stopping is not None:
+        # The last checkpoint then holds the best weights, and --resume
+        # continues from them with the epoch counter of the last epoch.
+        if early_stopping.restore_best_weights(model) and checkpointer is not None:
+            checkpointer.save(record["epoch"], record["elapsed"])
+        print(early_stopping.describe(), flush=True)
+        if metrics_log is not None:
+            summary_record = {"type": "summary", "elapsed": time.perf_counter() - start}
+            summary_record.update(early_stopping.summary())
+            metrics_log.update_metrics(summary_record)
+
+    if checkpointer is not None:
+        checkpointer.sync()
+
+    if weights_path is not None:
+        model.save_weights(weights_path)
+
+    return record
+
+
+def add_train_arguments(parser):
+    """
+    Add options of training to parser.
+
+    Parameters
+    ----------
+        parser : argparse.ArgumentParser
+    """
+    parser.add_argument("--train-path", default=TRAIN_DATA_PATH)
+    parser.add_argument("--weights", default=WEIGHTS_PATH)
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--learning-rate", type=float, default=LEARNING_RATE)
+    parser.add_argument(
+        "--architecture", choices=list(ARCHITECTURES), default=ARCHITECTURE
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue from the latest checkpoint in CHECKPOINT_DIR. after "
+        "early stopping it holds the best weights with the last epoch number",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="train without gui and write metrics to --metrics-log",
+    )
+    parser.add_argument(
+        "--metrics-log",
+        help="append metrics to this jsonl file. default is METRICS_LOG_PATH "
+        "when headless",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=PROFILE,
+        help="time every phase of training and print a table after each epoch",
+    )
+    parser.add_argument(
+        "--profile-trace-steps",
+        type=int,
+        nargs=2,
+        metavar=("START", "STOP"),
+        default=PROFILE_TRACE_STEPS,
+        help="write a tf.profiler trace of steps START to STOP - 1 to "
+        "PROFILE_LOG_DIR. implies --profile",
+    )
+    parser.add_argument(
+        "--early-stopping",
+        choices=MONITORS,
+        default=EARLY_STOPPING,
+        help="stop when this metric has not improved for --patience epochs "
+        "and restore the best weights",
+    )
+    parser.add_argument("--patience", type=int, default=PATIENCE)
+    parser.add_argument(
+        "--target-accuracy",
+        type=float,
+        default=TARGET_ACCURACY,
+        help="stop when validation accuracy reaches this value and report "
+        "time to accuracy",
+    )
+
+
+def run_training(args):
+    """
+    Train with options added by add_train_arguments.
+
+    Parameters
+    ----------
+        args : argparse.Namespace
+
+    Returns
+    -------
+        status : int
+            exit status.
+    """
+    model, loss_object, optimizer, metrics_loss, metrics_accuracy = build_training(
+        learning_rate=args.learning_rate,
+        batch_size=args.batch_size,
+        architecture=args.architecture,
+    )
+
+    checkpointer = Checkpointer(CHECKPOINT_DIR, model, optimizer)
+    initial_epoch = checkpointer.restore() if args.resume else 0
+    initial_elapsed = float(checkpointer.elapsed.numpy()) if args.resume else 0.0
+
+    metrics_log_path = args.metrics_log
+    if args.headless and metrics_log_path is None:
+        metrics_log_path = METRICS_LOG_PATH
+    metrics_log = None if metrics_log_path is None else MetricsLog(metrics_log_path)
 
-if __name__ == "__main__":
     train_dataset, test_dataset = get_train_dataset(
-        TRAIN_DATA_PATH, VALIDATION_NUM, BATCH_SIZE
+        args.train_path, VALIDATION_NUM, args.batch_size, STREAMING, AUGMENT, SEED
     )
+    train_args = (
+        train_dataset,
+        test_dataset,
+        model,
+        loss_object,
+        optimizer,
+        args.epochs,
+        metrics_loss,
+        metrics_accuracy,
+        metrics_loss,
+        metrics_accuracy,
+    )
+    train_kwargs = {
+        "steps_per_execution": STEPS_PER_EXECUTION,
+        "weights_path": args.weights,
+        "checkpointer": checkpointer,
+        "initial_epoch": initial_epoch,
+        "initial_elapsed": initial_elapsed,
+        "metrics_log": metrics_log,
+        "log_every": LOG_EVERY,
+        "jit_compile": JIT_COMPILE,
+    }
+    if args.profile or args.profile_trace_steps is not None:
+        train_kwargs["profiler"] = PhaseProfiler(
+            trace_steps=args.profile_trace_steps, log_dir=PROFILE_LOG_DIR
+        )
+
+    if args.early_stopping is not None or args.target_accuracy is not None:
+        train_kwargs["early_stopping"] = EarlyStopping(
+            args.early_stopping, args.patience, target_accuracy=args.target_accuracy
+        )
+
+    if args.headless:
+        try:
+            train(*train_args, **train_kwargs)
+        finally:
+            metrics_log.close()
+        return 0
+
+    from PyQt5.QtWidgets import QApplication
+    from gui import Main
+
     app = QApplication(sys.argv)
     ex = Main()
     t1 = threading.Thread(
-        target=train,
-        args=(
-            train_dataset,
-            test_dataset,
-            model_,
-            loss_object_,
-            optimzer_,
-            EPOCHS,
-            metrics_loss,
-            metrics_accuracy,
-            metrics_loss,
-            metrics_accuracy,
-            ex,
-        ),
+        target=train, args=train_args + (ex,), kwargs=train_kwargs
     )
     t1.daemon = True
     t1.start()
-    sys.exit(app.exec_())
+    try:
+        return app.exec_()
+    finally:
+        # Records of a training thread still running are dropped.
+        if metrics_log is not None:
+            metrics_log.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train digit recognizer.")
+    add_train_arguments(parser)
+    sys.exit(run_training(parser.parse_args()))
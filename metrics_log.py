@@ -0,0 +1,129 @@
+"""Module for writing metric records to an append-only jsonl log and reading them back."""
+import json
+import time
+import queue
+import threading
+import numpy as np
+
+
+FLUSH_INTERVAL = 1.0
+
+
+def to_json(value):
+    """
+    Convert numpy values of a record into json types.
+
+    Parameters
+    ----------
+        value : object
+
+    Returns
+    -------
+        value : object
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("{} is not JSON serializable".format(type(value).__name__))
+
+
+class MetricsLog:
+    """
+    A class to append metric records to a jsonl file off the training thread.
+
+    Records are put on a queue and written by a background thread, which
+    flushes the file at most every flush_interval seconds.
+
+    Attributes
+    ----------
+        path : string
+            path of the log.
+        flush_interval : float
+            seconds between flushes.
+
+    Methods
+    -------
+        update_metrics(record):
+            queue a record. same interface as gui.Main.update_metrics.
+        close():
+            write every queued record and close the file.
+    """
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        """
+        Initialize log and start writer thread.
+
+        Parameters
+        ----------
+            path : string
+                path of the log. records are appended if it exists.
+            flush_interval : float
+                seconds between flushes.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self.file = open(path, "a")
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def update_metrics(self, record):
+        self.queue.put(record)
+
+    def write_loop(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self.file.flush()
+                last_flush = time.monotonic()
+                continue
+            if record is None:
+                break
+
+            self.file.write(json.dumps(record, default=to_json) + "\n")
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self.file.flush()
+                last_flush = time.monotonic()
+        self.file.close()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+def read_records(path, position=0):
+    """
+    Read complete records appended to a log since position.
+
+    Parameters
+    ----------
+        path : string
+            path of the log.
+        position : int
+            byte offset returned by the last call.
+
+    Returns
+    -------
+        records : list of dict
+        position : int
+            byte offset to pass to the next call.
+    """
+    records = []
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return records, position
+
+    with f:
+        f.seek(position)
+        for line in f:
+            # Leave a partially written last line for the next call.
+            if not line.endswith(b"\n"):
+                break
+            position += len(line)
+            records.append(json.loads(line))
+
+    return records, position
@@ -1,5 +1,7 @@
 """Module for building deep learning model."""
 import tensorflow as tf
+from config import ARCHITECTURE
+from config import ARCHITECTURE_NAMES
 
 
 class Model(tf.keras.Model):
@@ -35,7 +37,8 @@ class Model(tf.keras.Model):
         self.conv1 = tf.keras.layers.Conv2D(32, 3, activation="relu")
         self.flatten = tf.keras.layers.Flatten()
         self.dense1 = tf.keras.layers.Dense(128, activation="relu")
-        self.dense2 = tf.keras.layers.Dense(10)
+        # Keep logits in float32 under mixed precision.
+        self.dense2 = tf.keras.layers.Dense(10, dtype="float32")
 
     def call(self, inputs, training=None, mask=None):
         """
@@ -60,3 +63,161 @@ class Model(tf.keras.Model):
         x = self.dense1(x)
         output = self.dense2(x)
         return output
+
+
+class PooledModel(tf.keras.Model):
+    """
+    A class to build CNN model with max pooling after each convolution.
+
+    Pooling shrinks the input of the dense layer from 26 * 26 * 32 to
+    5 * 5 * 64 values, which removes most parameters of Model.
+
+    Methods
+    -------
+        call(x):
+            return the output of model.
+    """
+
+    def __init__(self):
+        super(PooledModel, self).__init__()
+        self.conv1 = tf.keras.layers.Conv2D(32, 3, activation="relu")
+        self.pool1 = tf.keras.layers.MaxPooling2D(2)
+        self.conv2 = tf.keras.layers.Conv2D(64, 3, activation="relu")
+        self.pool2 = tf.keras.layers.MaxPooling2D(2)
+        self.flatten = tf.keras.layers.Flatten()
+        self.dense1 = tf.keras.layers.Dense(128, activation="relu")
+        self.dense2 = tf.keras.layers.Dense(10, dtype="float32")
+
+    def call(self, inputs, training=None, mask=None):
+        x = self.pool1(self.conv1(inputs))
+        x = self.pool2(self.conv2(x))
+        x = self.flatten(x)
+        x = self.dense1(x)
+        output = self.dense2(x)
+        return output
+
+
+class StridedModel(tf.keras.Model):
+    """
+    A class to build CNN model downsampling with strided convolutions.
+
+    Methods
+    -------
+        call(x):
+            return the output of model.
+    """
+
+    def __init__(self):
+        super(StridedModel, self).__init__()
+        self.conv1 = tf.keras.layers.Conv2D(32, 3, strides=2, activation="relu")
+        self.conv2 = tf.keras.layers.Conv2D(64, 3, strides=2, activation="relu")
+        self.flatten = tf.keras.layers.Flatten()
+        self.dense1 = tf.keras.layers.Dense(64, activation="relu")
+        self.dense2 = tf.keras.layers.Dense(10, dtype="float32")
+
+    def call(self, inputs, training=None, mask=None):
+        x = self.conv1(inputs)
+        x = self.conv2(x)
+        x = self.flatten(x)
+        x = self.dense1(x)
+        output = self.dense2(x)
+        return output
+
+
+class SeparableModel(tf.keras.Model):
+    """
+    A class to build CNN model of depthwise-separable convolutions.
+
+    Global average pooling replaces Flatten, so there is no large dense layer.
+
+    Methods
+    -------
+        call(x):
+            return the output of model.
+    """
+
+    def __init__(self):
+        super(SeparableModel, self).__init__()
+        self.conv1 = tf.keras.layers.Conv2D(32, 3, activation="relu")
+        self.conv2 = tf.keras.layers.SeparableConv2D(
+            64, 3, strides=2, activation="relu"
+        )
+        self.conv3 = tf.keras.layers.SeparableConv2D(
+            128, 3, strides=2, activation="relu"
+        )
+        self.pool = tf.keras.layers.GlobalAveragePooling2D()
+        self.dense1 = tf.keras.layers.Dense(10, dtype="float32")
+
+    def call(self, inputs, training=None, mask=None):
+        x = self.conv1(inputs)
+        x = self.conv2(x)
+        x = self.conv3(x)
+        x = self.pool(x)
+        output = self.dense1(x)
+        return output
+
+
+ARCHITECTURES = dict(
+    zip(ARCHITECTURE_NAMES, (Model, PooledModel, StridedModel, SeparableModel))
+)
+
+
+def build_model(architecture=ARCHITECTURE):
+    """
+    Build model of a named architecture.
+
+    Parameters
+    ----------
+        architecture : string
+            key of ARCHITECTURES.
+
+    Returns
+    -------
+        model : tf.keras.Model
+    """
+    if architecture not in ARCHITECTURES:
+        raise ValueError(
+            "architecture must be one of {}, got {}".format(
+                tuple(ARCHITECTURES), architecture
+            )
+        )
+    return ARCHITECTURES[architecture]()
+
+
+def count_flops(model, input_shape=(1, 28, 28, 1)):
+    """
+    Count floating point operations of one forward pass.
+
+    Layers are applied one after another in the order they were assigned,
+    which holds for every model of ARCHITECTURES. A multiply-add counts as 2.
+
+    Parameters
+    ----------
+        model : tf.keras.Model
+        input_shape : tuple
+            shape of the batch the layers are traced with. the count is per
+            image whatever its batch size.
+
+    Returns
+    -------
+        flops : int
+            per image.
+    """
+    x = tf.zeros(input_shape)
+    flops = 0
+    for layer in model.layers:
+        y = layer(x)
+        if isinstance(layer, tf.keras.layers.SeparableConv2D):
+            height, width = y.shape[1:3]
+            in_channels = x.shape[-1]
+            depthwise = layer.depthwise_kernel.shape
+            flops += 2 * height * width * depthwise[0] * depthwise[1] * in_channels
+            flops += 2 * height * width * in_channels * y.shape[-1]
+        elif isinstance(layer, tf.keras.layers.Conv2D):
+            height, width = y.shape[1:3]
+            kernel = layer.kernel.shape
+            flops += 2 * height * width * kernel[0] * kernel[1] * kernel[2] * kernel[3]
+        elif isinstance(layer, tf.keras.layers.Dense):
+            flops += 2 * layer.kernel.shape[0] * layer.kernel.shape[1]
+        x = y
+    return int(flops)
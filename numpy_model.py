@@ -0,0 +1,161 @@
+"""Module for running model with numpy only, without importing tensorflow."""
+import argparse
+import numpy as np
+from config import WEIGHTS_PATH
+from config import NPZ_PATH
+
+
+PIXEL_SCALE = 255.0
+
+
+def export_weights(model, path):
+    """
+    Save weights of model.Model into npz file.
+
+    Only the baseline architecture of model.ARCHITECTURES is supported.
+
+    Parameters
+    ----------
+        model : model.Model
+            trained model.
+        path : string
+            path of the npz file.
+    """
+    np.savez(
+        path,
+        conv1_kernel=np.asarray(model.conv1.kernel, np.float32),
+        conv1_bias=np.asarray(model.conv1.bias, np.float32),
+        dense1_kernel=np.asarray(model.dense1.kernel, np.float32),
+        dense1_bias=np.asarray(model.dense1.bias, np.float32),
+        dense2_kernel=np.asarray(model.dense2.kernel, np.float32),
+        dense2_bias=np.asarray(model.dense2.bias, np.float32),
+    )
+
+
+def conv2d(inputs, kernel, bias):
+    """
+    Valid 2d convolution with stride 1 by im2col and one matrix product.
+
+    Parameters
+    ----------
+        inputs : ndarray
+            shape = (batch, height, width, in_channels)
+        kernel : ndarray
+            shape = (kernel_height, kernel_width, in_channels, out_channels)
+        bias : ndarray
+            shape = (out_channels,)
+
+    Returns
+    -------
+        output : ndarray
+            shape = (batch, height - kernel_height + 1, width - kernel_width + 1,
+            out_channels)
+    """
+    kernel_height, kernel_width, in_channels, out_channels = kernel.shape
+    # (batch, out_height, out_width, in_channels, kernel_height, kernel_width)
+    windows = np.lib.stride_tricks.sliding_window_view(
+        inputs, (kernel_height, kernel_width), axis=(1, 2)
+    )
+    batch, out_height, out_width = windows.shape[:3]
+    columns = windows.transpose(0, 1, 2, 4, 5, 3).reshape(
+        batch * out_height * out_width, kernel_height * kernel_width * in_channels
+    )
+    output = columns @ kernel.reshape(-1, out_channels) + bias
+    return output.reshape(batch, out_height, out_width, out_channels)
+
+
+def relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+class NumpyModel:
+    """
+    A class to run the forward pass of model.Model with numpy.
+
+    Attributes
+    ----------
+        weights : dict of ndarray
+            weights loaded from npz file.
+
+    Methods
+    -------
+        __call__(inputs):
+            return logits of float32 inputs.
+        predict(images):
+            return digits of uint8 images.
+    """
+
+    def __init__(self, path):
+        """
+        Load weights.
+
+        Parameters
+        ----------
+            path : string
+                path of npz file written by export_weights.
+        """
+        with np.load(path) as data:
+            self.weights = {name: data[name] for name in data.files}
+
+    def __call__(self, inputs):
+        """
+        Compute logits.
+
+        Parameters
+        ----------
+            inputs : ndarray
+                float32 images in [0, 1]. shape = (, 28, 28, 1)
+
+        Returns
+        -------
+            output : ndarray
+                logits. shape = (, 10)
+        """
+        w = self.weights
+        x = relu(conv2d(inputs, w["conv1_kernel"], w["conv1_bias"]))
+        x = x.reshape(len(x), -1)
+        x = relu(x @ w["dense1_kernel"] + w["dense1_bias"])
+        output = x @ w["dense2_kernel"] + w["dense2_bias"]
+        return output
+
+    def predict(self, images):
+        """
+        Predict digits.
+
+        Parameters
+        ----------
+            images : ndarray
+                uint8 images. shape = (, 28, 28, 1)
+
+        Returns
+        -------
+            labels : ndarray
+        """
+        inputs = images.astype(np.float32) / np.float32(PIXEL_SCALE)
+        return np.argmax(self(inputs), axis=-1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export weights for NumpyModel.")
+    parser.add_argument("--weights", default=WEIGHTS_PATH)
+    parser.add_argument("--output", default=NPZ_PATH)
+    parser.add_argument(
+        "--check",
+        type=int,
+        default=256,
+        help="compare outputs with tensorflow on this many random images",
+    )
+    args = parser.parse_args()
+
+    # Only exporting needs tensorflow.
+    from inference import load_model
+
+    model = load_model(args.weights)
+    export_weights(model, args.output)
+
+    if args.check:
+        rng = np.random.default_rng(0)
+        inputs = rng.random((args.check, 28, 28, 1), dtype=np.float32)
+        expected = np.asarray(model(inputs, training=False))
+        actual = NumpyModel(args.output)(inputs)
+        print("max abs difference: {:.2e}".format(np.max(np.abs(expected - actual))))
@@ -0,0 +1,157 @@
+"""Module for caching predictions by image content."""
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+
+MAX_ENTRIES = 100000
+
+
+def image_key(image):
+    """
+    Hash the pixels of an image.
+
+    Parameters
+    ----------
+        image : ndarray
+            uint8 image.
+
+    Returns
+    -------
+        key : bytes
+    """
+    return hashlib.blake2b(
+        np.ascontiguousarray(image, np.uint8).data, digest_size=16
+    ).digest()
+
+
+def weights_version(weights):
+    """
+    Hash weights of a model.
+
+    Parameters
+    ----------
+        weights : list of ndarray
+            e.g. model.get_weights().
+
+    Returns
+    -------
+        version : string
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for weight in weights:
+        digest.update(np.ascontiguousarray(weight).data)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+    A class to keep labels of recently predicted images, least recently used first out.
+
+    Attributes
+    ----------
+        max_entries : int
+            number of labels kept.
+        version : string or None
+            weights version the kept labels were predicted with.
+        hits : int
+        misses : int
+        evictions : int
+        invalidations : int
+            number of times the cache was cleared by a new version.
+        pending : dict
+            futures of keys being predicted, so identical requests arriving
+            at the same time can share one prediction. changed only through
+            the pending methods.
+        shared : int
+            number of misses that waited for a pending prediction.
+
+    Methods
+    -------
+        get(key):
+            return label of key or None.
+        put(key, label, version):
+            keep label of key if it was predicted with the current version.
+        get_pending(key):
+            return future of key being predicted, counted as shared, or None.
+        add_pending(key, future):
+            mark key as being predicted by future.
+        pop_pending(key, future):
+            forget future of key once its prediction is done.
+        set_version(version):
+            clear the cache if version is new.
+        stats():
+            return counters as dict.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, version=None):
+        self.max_entries = max_entries
+        self.version = version
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.pending = {}
+        self.shared = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        label = self.entries.get(key)
+        if label is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return label
+
+    def put(self, key, label, version=None):
+        if self.max_entries <= 0:
+            return
+        # A prediction started before a reload must not outlive the old weights.
+        if version is not None and version != self.version:
+            return
+        self.entries[key] = label
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_pending(self, key):
+        future = self.pending.get(key)
+        if future is not None:
+            self.shared += 1
+        return future
+
+    def add_pending(self, key, future):
+        self.pending[key] = future
+
+    def pop_pending(self, key, future):
+        # A reload may have replaced the pending future of key since.
+        if self.pending.get(key) is future:
+            del self.pending[key]
+
+    def set_version(self, version):
+        if version == self.version:
+            return
+        self.version = version
+        # Requests waiting on old predictions keep them, new ones predict again.
+        self.pending = {}
+        if self.entries:
+            self.entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "shared": self.shared,
+            "saved_rate": (self.hits + self.shared) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
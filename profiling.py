@@ -0,0 +1,250 @@
+"""Module for timing phases of the training loop."""
+import time
+import contextlib
+from collections import OrderedDict
+import tensorflow as tf
+
+
+STALL_THRESHOLD = 0.001
+
+
+class PhaseProfiler:
+    """
+    A class to record wall-clock and cpu time of named phases.
+
+    Attributes
+    ----------
+        phases : OrderedDict
+            name: [count, wall seconds, cpu seconds], in order of first use.
+        stalls : int
+            number of times the data phase took longer than stall_threshold.
+        stall_threshold : float
+            seconds of waiting for data counted as a stall.
+        trace_start : int or None
+            step at which a tf.profiler trace starts.
+        trace_stop : int or None
+            step at which the trace stops.
+        log_dir : string or None
+            directory of the trace.
+
+    Methods
+    -------
+        phase(name):
+            context manager timing its body as phase name.
+        step(step):
+            start or stop the tf.profiler trace at the chosen steps.
+        stop_trace():
+            stop the trace if it is running.
+        as_dict():
+            return recorded times as dict, for MetricsLog.
+        summary():
+            return table of phases as string.
+        reset():
+            forget recorded times.
+    """
+
+    def __init__(
+        self,
+        stall_threshold=STALL_THRESHOLD,
+        trace_steps=None,
+        log_dir=None,
+    ):
+        """
+        Initialize profiler.
+
+        Parameters
+        ----------
+            stall_threshold : float
+            trace_steps : tuple of int or None
+                (first step, step after last) of the tf.profiler trace window.
+            log_dir : string or None
+                directory of the trace, for tensorboard.
+        """
+        self.stall_threshold = stall_threshold
+        self.trace_start, self.trace_stop = trace_steps or (None, None)
+        self.log_dir = log_dir
+        self.tracing = False
+        self.reset()
+
+    def reset(self):
+        self.phases = OrderedDict()
+        self.stalls = 0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            record = self.phases.setdefault(name, [0, 0.0, 0.0])
+            record[0] += 1
+            record[1] += wall
+            record[2] += cpu
+            if name == "data" and wall > self.stall_threshold:
+                self.stalls += 1
+
+    def step(self, step):
+        if self.trace_start is None:
+            return
+        if step == self.trace_start and not self.tracing:
+            tf.profiler.experimental.start(self.log_dir)
+            self.tracing = True
+        elif step == self.trace_stop:
+            self.stop_trace()
+
+    def stop_trace(self):
+        if self.tracing:
+            tf.profiler.experimental.stop()
+            self.tracing = False
+
+    def as_dict(self):
+        return {
+            "stalls": self.stalls,
+            "phases": {
+                name: {"count": count, "wall": wall, "cpu": cpu}
+                for name, (count, wall, cpu) in self.phases.items()
+            },
+        }
+
+    def summary(self):
+        total = sum(wall for _, wall, _ in self.phases.values()) or 1.0
+        lines = [
+            "{:<18}{:>8}{:>10}{:>10}{:>8}{:>12}".format(
+                "phase", "count", "wall(s)", "cpu(s)", "wall%", "mean(ms)"
+            )
+        ]
+        for name, (count, wall, cpu) in self.phases.items():
+            lines.append(
+                "{:<18}{:>8}{:>10.3f}{:>10.3f}{:>7.1f}%{:>12.3f}".format(
+                    name, count, wall, cpu, 100.0 * wall / total, 1000.0 * wall / count
+                )
+            )
+        lines.append(
+            "input stalls (> {:.1f}ms): {}".format(
+                1000.0 * self.stall_threshold, self.stalls
+            )
+        )
+        return "\n".join(lines)
+
+
+def null_phase(name):  # pylint: disable=unused-argument
+    """Stand-in for PhaseProfiler.phase when not profiling."""
+    return contextlib.nullcontext()
+
+
+def make_profiled_train_step(
+    model,
+    loss_object,
+    optimizer,
+    train_metrics_loss,
+    train_metrics_accuracy,
+):
+    """
+    Build training step split into separately compiled phases.
+
+    Forward and backward pass share one gradient tape, so they are timed
+    together. Splitting the step costs some speed, so use this only to profile.
+
+    Parameters
+    ----------
+        model : tf.keras.Model
+        loss_object : tf.keras.losses
+        optimizer : tf.keras.optimizers
+        train_metrics_loss : tf.keras.metrics
+        train_metrics_accuracy : tf.keras.metrics
+
+    Returns
+    -------
+        forward_backward : tf.function
+            takes (images, labels), returns (loss, predictions, gradients).
+        apply_gradients : tf.function
+            takes gradients.
+        update_metrics : tf.function
+            takes (loss, labels, predictions).
+    """
+
+    @tf.function
+    def forward_backward(images, labels):
+        with tf.GradientTape() as tape:
+            predictions = model(images, training=True)
+            loss = loss_object(labels, predictions)
+            scaled_loss = optimizer.scale_loss(loss)
+        gradients = tape.gradient(scaled_loss, model.trainable_variables)
+        return loss, predictions, gradients
+
+    @tf.function
+    def apply_gradients(gradients):
+        optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+
+    @tf.function
+    def update_metrics(loss, labels, predictions):
+        train_metrics_loss(loss)
+        train_metrics_accuracy(labels, predictions)
+
+    return forward_backward, apply_gradients, update_metrics
+
+
+def profiled_train_epoch(
+    data_loader,
+    profiled_step,
+    train_metrics_loss,
+    train_metrics_accuracy,
+    profiler,
+    first_step=0,
+    on_step=None,
+):
+    """
+    Function for training model in one epoch while timing every phase.
+
+    Parameters
+    ----------
+        data_loader : tf.data.Dataset
+        profiled_step : tuple
+            functions returned by make_profiled_train_step.
+        train_metrics_loss : tf.keras.metrics
+        train_metrics_accuracy : tf.keras.metrics
+        profiler : PhaseProfiler
+        first_step : int
+            global number of the first step, for the trace window.
+        on_step : callable or None
+            called with 1 after every step.
+
+    Returns
+    -------
+        train_loss : float
+        train_accuracy : float
+        steps : int
+            number of steps run.
+    """
+    forward_backward, apply_gradients, update_metrics = profiled_step
+
+    train_metrics_loss.reset_state()
+    train_metrics_accuracy.reset_state()
+
+    iterator = iter(data_loader)
+    steps = 0
+    while True:
+        profiler.step(first_step + steps)
+        with profiler.phase("data"):
+            try:
+                images, labels = next(iterator)
+            except StopIteration:
+                break
+        with profiler.phase("forward_backward"):
+            loss, predictions, gradients = forward_backward(images, labels)
+        with profiler.phase("optimizer"):
+            apply_gradients(gradients)
+        with profiler.phase("metrics"):
+            update_metrics(loss, labels, predictions)
+        if on_step is not None:
+            with profiler.phase("step_callback"):
+                on_step(1)
+        steps += 1
+
+    train_loss = float(train_metrics_loss.result().numpy())
+    train_accuracy = float(train_metrics_accuracy.result().numpy())
+
+    return train_loss, train_accuracy, steps
@@ -0,0 +1,228 @@
+"""Module for exporting model as int8 tflite and comparing it with the float model."""
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+from inference import load_model
+from inference import summarize_latency
+from utils import get_train_dataset
+from config import TRAIN_DATA_PATH
+from config import WEIGHTS_PATH
+from config import TFLITE_PATH
+from config import INT8_TFLITE_PATH
+from config import VALIDATION_NUM
+from config import ARCHITECTURE
+from config import ARCHITECTURE_NAMES
+
+
+BATCH_SIZE = 256
+CALIBRATION_BATCHES = 20
+
+
+def convert(model, calibration_dataset=None, calibration_batches=CALIBRATION_BATCHES):
+    """
+    Convert model into tflite.
+
+    Parameters
+    ----------
+        model : tf.keras.Model
+            trained model.
+        calibration_dataset : tf.data.Dataset or None
+            batches of (images, labels) used to choose quantization ranges. if
+            None, the model is converted without quantization.
+        calibration_batches : int
+            number of batches of calibration_dataset used.
+
+    Returns
+    -------
+        model_content : bytes
+            tflite flatbuffer. int8 weights and activations if calibrated,
+            with float32 input and output.
+    """
+
+    # from_keras_model freezes the weights into constants through public api.
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    if calibration_dataset is not None:
+
+        def representative_dataset():
+            for images, _ in calibration_dataset.take(calibration_batches):
+                for image in images:
+                    yield [image[tf.newaxis, ...]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    return converter.convert()
+
+
+class TFLiteRunner:
+    """
+    A class to run tflite model on image batches.
+
+    Methods
+    -------
+        __call__(images):
+            return logits of images.
+    """
+
+    def __init__(self, model_content, num_threads=None):
+        """
+        Initialize interpreter.
+
+        Parameters
+        ----------
+            model_content : bytes
+                tflite flatbuffer.
+            num_threads : int or None
+        """
+        self.model_content = model_content
+        self.num_threads = num_threads
+        self.interpreter = tf.lite.Interpreter(
+            model_content=model_content, num_threads=num_threads
+        )
+        self.input_index = self.interpreter.get_input_details()[0]["index"]
+        self.output_index = self.interpreter.get_output_details()[0]["index"]
+        self.batch_size = None
+
+    def resize(self, batch_size):
+        self.interpreter.resize_tensor_input(
+            self.input_index, (batch_size, 28, 28, 1)
+        )
+        try:
+            self.interpreter.allocate_tensors()
+        except RuntimeError:
+            # Some XNNPACK builds cannot run int8 graphs; use builtin kernels.
+            self.interpreter = tf.lite.Interpreter(
+                model_content=self.model_content,
+                num_threads=self.num_threads,
+                experimental_op_resolver_type=(
+                    tf.lite.experimental.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+                ),
+            )
+            self.interpreter.resize_tensor_input(
+                self.input_index, (batch_size, 28, 28, 1)
+            )
+            self.interpreter.allocate_tensors()
+        self.batch_size = batch_size
+
+    def __call__(self, images):
+        if len(images) != self.batch_size:
+            self.resize(len(images))
+        self.interpreter.set_tensor(self.input_index, images)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
+
+
+def evaluate(predict, dataset):
+    """
+    Measure accuracy and latency of a predict function.
+
+    Parameters
+    ----------
+        predict : callable
+            takes float32 ndarray images and returns logits.
+        dataset : tf.data.Dataset
+            batches of (images, labels).
+
+    Returns
+    -------
+        stats : dict
+            accuracy and the stats of inference.summarize_latency.
+    """
+    correct = 0
+    num_images = 0
+    latencies = []
+    for images, labels in dataset.as_numpy_iterator():
+        start = time.perf_counter()
+        logits = np.asarray(predict(images))
+        latencies.append(time.perf_counter() - start)
+
+        correct += int(np.sum(np.argmax(logits, axis=-1) == labels))
+        num_images += len(labels)
+
+    stats = summarize_latency(num_images, sum(latencies), latencies)
+    stats["accuracy"] = correct / num_images
+    return stats
+
+
+def compare(model, calibration_dataset, validation_dataset):
+    """
+    Compare keras, float tflite and int8 tflite model on validation data.
+
+    Parameters
+    ----------
+        model : tf.keras.Model
+            trained model.
+        calibration_dataset : tf.data.Dataset
+        validation_dataset : tf.data.Dataset
+
+    Returns
+    -------
+        results : dict
+            stats of evaluate and "size_bytes" per model name.
+        contents : dict
+            tflite flatbuffer per model name.
+    """
+    contents = {
+        "float_tflite": convert(model),
+        "int8_tflite": convert(model, calibration_dataset),
+    }
+
+    keras_predict = tf.function(
+        lambda images: model(images, training=False),
+        input_signature=[tf.TensorSpec(shape=(None, 28, 28, 1), dtype=tf.float32)],
+    )
+    results = {"keras": evaluate(keras_predict, validation_dataset)}
+    results["keras"]["size_bytes"] = sum(
+        int(np.prod(variable.shape)) * 4 for variable in model.weights
+    )
+
+    for name, content in contents.items():
+        results[name] = evaluate(TFLiteRunner(content), validation_dataset)
+        results[name]["size_bytes"] = len(content)
+
+    return results, contents
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export int8 tflite model.")
+    parser.add_argument("--train-path", default=TRAIN_DATA_PATH)
+    parser.add_argument("--weights", default=WEIGHTS_PATH)
+    parser.add_argument(
+        "--architecture", choices=ARCHITECTURE_NAMES, default=ARCHITECTURE
+    )
+    parser.add_argument("--float-output", default=TFLITE_PATH)
+    parser.add_argument("--int8-output", default=INT8_TFLITE_PATH)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    train_dataset, validation_dataset = get_train_dataset(
+        args.train_path, VALIDATION_NUM, args.batch_size
+    )
+    results, contents = compare(
+        load_model(args.weights, args.architecture), train_dataset, validation_dataset
+    )
+
+    with open(args.float_output, "wb") as f:
+        f.write(contents["float_tflite"])
+    with open(args.int8_output, "wb") as f:
+        f.write(contents["int8_tflite"])
+
+    print(
+        "{:<14}{:>12}{:>10}{:>14}{:>10}{:>10}".format(
+            "model", "size(KB)", "accuracy", "images/sec", "p50(ms)", "p99(ms)"
+        )
+    )
+    for name, stats in results.items():
+        print(
+            "{:<14}{:>12.0f}{:>10.4f}{:>14.0f}{:>10.2f}{:>10.2f}".format(
+                name,
+                stats["size_bytes"] / 1024,
+                stats["accuracy"],
+                stats["images_per_second"],
+                stats["p50_latency_ms"],
+                stats["p99_latency_ms"],
+            )
+        )
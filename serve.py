@@ -0,0 +1,386 @@
+"""Module for serving digit recognition over http with dynamic micro-batching."""
+import json
+import time
+import queue
+import asyncio
+import argparse
+import threading
+from concurrent.futures import Future
+import numpy as np
+from prediction_cache import image_key
+from prediction_cache import weights_version
+from prediction_cache import PredictionCache
+from config import WEIGHTS_PATH
+from config import ARCHITECTURE
+from config import ARCHITECTURE_NAMES
+
+
+HOST = "127.0.0.1"
+PORT = 8000
+MAX_BATCH_SIZE = 64
+MAX_DELAY = 0.002
+CACHE_SIZE = 100000
+IMAGE_BYTES = 28 * 28
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+
+class MicroBatcher:
+    """
+    A class to collect single images into batches for one worker thread.
+
+    The worker waits for a first image, then keeps collecting until it has
+    max_batch_size images or max_delay seconds have passed since the first
+    one, and runs the whole batch in one call of predict_fn.
+
+    Attributes
+    ----------
+        predict_fn : callable
+            takes uint8 images of shape (, 28, 28, 1) and returns labels.
+        max_batch_size : int
+        max_delay : float
+            seconds the first image of a batch may wait for others.
+        requests : int
+            number of images predicted.
+        batches : int
+            number of batches run.
+
+    Methods
+    -------
+        submit(image):
+            queue one image and return a Future of its label.
+        close():
+            stop the worker thread.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=MAX_BATCH_SIZE, max_delay=MAX_DELAY):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.requests = 0
+        self.batches = 0
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, image):
+        future = Future()
+        self.queue.put((image, future))
+        return future
+
+    def collect(self):
+        """
+        Wait for the next batch.
+
+        Returns
+        -------
+            batch : list of (ndarray, Future)
+            closed : boolean
+                whether close was called.
+        """
+        item = self.queue.get()
+        if item is None:
+            return [], True
+
+        batch = [item]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    item = self.queue.get(timeout=timeout)
+                else:
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def run(self):
+        closed = False
+        while not closed:
+            batch, closed = self.collect()
+            if not batch:
+                continue
+
+            images = np.stack([image for image, _ in batch])
+            try:
+                labels = np.asarray(self.predict_fn(images))
+            except Exception as error:  # pylint: disable=broad-except
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            self.requests += len(batch)
+            self.batches += 1
+            for (_, future), label in zip(batch, labels):
+                future.set_result(int(label))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+def make_response(status, payload):
+    body = json.dumps(payload).encode()
+    head = (
+        "HTTP/1.1 {} {}\r\n"
+        "Content-Type: application/json\r\n"
+        "Content-Length: {}\r\n"
+        "\r\n".format(status, STATUS_TEXT[status], len(body))
+    )
+    return head.encode() + body
+
+
+async def predict_image(image, batcher, cache=None):
+    """
+    Predict one image, from cache if it was seen before.
+
+    Parameters
+    ----------
+        image : ndarray
+            uint8 image. shape = (28, 28, 1)
+        batcher : MicroBatcher
+        cache : PredictionCache or None
+
+    Returns
+    -------
+        label : int
+    """
+    if cache is None:
+        return await asyncio.wrap_future(batcher.submit(image))
+
+    key = image_key(image)
+    label = cache.get(key)
+    if label is not None:
+        return label
+
+    # Wait for an identical image already in flight instead of predicting it again.
+    future = cache.get_pending(key)
+    if future is not None:
+        return await asyncio.shield(future)
+
+    version = cache.version
+    future = asyncio.wrap_future(batcher.submit(image))
+    cache.add_pending(key, future)
+    try:
+        label = await future
+    finally:
+        cache.pop_pending(key, future)
+    cache.put(key, label, version)
+    return label
+
+
+async def reload_model(batcher, cache, load):
+    """
+    Load new weights and swap them in without stopping the server.
+
+    Parameters
+    ----------
+        batcher : MicroBatcher
+        cache : PredictionCache or None
+            cleared if the weights version changed.
+        load : callable
+            returns (predict_fn, version), e.g. make_model_predict_fn.
+
+    Returns
+    -------
+        version : string
+    """
+    loop = asyncio.get_running_loop()
+    predict_fn, version = await loop.run_in_executor(None, load)
+    batcher.predict_fn = predict_fn
+    if cache is not None:
+        cache.set_version(version)
+    return version
+
+
+async def handle_connection(reader, writer, batcher, cache=None, load=None):
+    """
+    Serve http requests of one keep-alive connection.
+
+    POST /predict takes 784 raw uint8 pixels as body and returns {"label": n}.
+    POST /reload loads the weights again and returns {"version": hash}.
+    GET /stats returns request, batch and cache counters.
+
+    Parameters
+    ----------
+        reader : asyncio.StreamReader
+        writer : asyncio.StreamWriter
+        batcher : MicroBatcher
+        cache : PredictionCache or None
+        load : callable or None
+            used by POST /reload. see reload_model.
+    """
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target = request_line.decode("latin-1").split()[:2]
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, value = line.decode("latin-1").split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            if method == "POST" and target == "/predict":
+                if len(body) != IMAGE_BYTES:
+                    response = make_response(
+                        400, {"error": "body must be {} bytes".format(IMAGE_BYTES)}
+                    )
+                else:
+                    image = np.frombuffer(body, np.uint8).reshape(28, 28, 1)
+                    try:
+                        label = await predict_image(image, batcher, cache)
+                        response = make_response(200, {"label": label})
+                    except Exception as error:  # pylint: disable=broad-except
+                        response = make_response(500, {"error": str(error)})
+            elif method == "POST" and target == "/reload" and load is not None:
+                try:
+                    version = await reload_model(batcher, cache, load)
+                    response = make_response(200, {"version": version})
+                except Exception as error:  # pylint: disable=broad-except
+                    response = make_response(500, {"error": str(error)})
+            elif method == "GET" and target == "/stats":
+                stats = {
+                    "requests": batcher.requests,
+                    "batches": batcher.batches,
+                    "mean_batch_size": batcher.requests / max(batcher.batches, 1),
+                }
+                if cache is not None:
+                    stats["cache"] = cache.stats()
+                response = make_response(200, stats)
+            else:
+                response = make_response(404, {"error": "not found"})
+
+            writer.write(response)
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close":
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(
+    batcher, host=HOST, port=PORT, unix_path=None, cache=None, load=None
+):
+    """
+    Start http server on a tcp port or a unix socket.
+
+    Parameters
+    ----------
+        batcher : MicroBatcher
+        host : string
+        port : int
+            0 to pick a free port.
+        unix_path : string or None
+            if given, listen on this unix socket instead of host and port.
+        cache : PredictionCache or None
+        load : callable or None
+            enables POST /reload. see reload_model.
+
+    Returns
+    -------
+        server : asyncio.Server
+    """
+
+    async def handler(reader, writer):
+        await handle_connection(reader, writer, batcher, cache, load)
+
+    if unix_path is not None:
+        return await asyncio.start_unix_server(handler, path=unix_path)
+    return await asyncio.start_server(handler, host, port)
+
+
+def make_model_predict_fn(weights_path=None, architecture=ARCHITECTURE):
+    """
+    Build compiled predict function of a model.
+
+    Parameters
+    ----------
+        weights_path : string or None
+            trained weights. random weights if None, for benchmarking.
+        architecture : string
+            key of model.ARCHITECTURES the weights were trained with.
+
+    Returns
+    -------
+        predict_fn : callable
+            takes uint8 images of shape (, 28, 28, 1) and returns labels.
+        version : string
+            hash of the weights, for PredictionCache.
+    """
+    import tensorflow as tf
+    from model import build_model
+    from inference import load_model
+    from inference import make_predict_step
+
+    if weights_path is None:
+        model = build_model(architecture)
+    else:
+        model = load_model(weights_path, architecture)
+    predict_step = make_predict_step(model)
+
+    # Trace before the first request arrives.
+    predict_step(tf.zeros((1, 28, 28, 1), tf.uint8))
+
+    def predict_fn(images):
+        return predict_step(images).numpy()
+
+    return predict_fn, weights_version(model.get_weights())
+
+
+async def serve_forever(args):
+    predict_fn, version = make_model_predict_fn(args.weights, args.architecture)
+    batcher = MicroBatcher(predict_fn, args.max_batch_size, args.max_delay)
+    cache = None
+    if args.cache_size > 0:
+        cache = PredictionCache(args.cache_size, version)
+    server = await start_server(
+        batcher,
+        args.host,
+        args.port,
+        args.unix,
+        cache,
+        lambda: make_model_predict_fn(args.weights, args.architecture),
+    )
+    address = args.unix or "http://{}:{}".format(args.host, args.port)
+    print("serving on {}".format(address), flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve digit recognition.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--unix", help="listen on this unix socket path")
+    parser.add_argument("--weights", default=WEIGHTS_PATH)
+    parser.add_argument(
+        "--architecture", choices=ARCHITECTURE_NAMES, default=ARCHITECTURE
+    )
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument(
+        "--max-delay",
+        type=float,
+        default=MAX_DELAY,
+        help="seconds a request may wait for others to join its batch",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=CACHE_SIZE,
+        help="number of predictions cached by image content, 0 to disable",
+    )
+    args = parser.parse_args()
+
+    asyncio.run(serve_forever(args))
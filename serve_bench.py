@@ -0,0 +1,219 @@
+"""Module for measuring throughput and tail latency of serve.py under load."""
+import time
+import asyncio
+import argparse
+import numpy as np
+from serve import MicroBatcher
+from serve import start_server
+from serve import make_model_predict_fn
+from prediction_cache import PredictionCache
+from config import ARCHITECTURE
+from config import ARCHITECTURE_NAMES
+
+
+BATCH_SIZES = [1, 8, 32, 128]
+DELAYS = [0.0, 0.001, 0.005]
+CONCURRENCY = 64
+REQUESTS_PER_CLIENT = 50
+DISTINCT_IMAGES = 256
+
+
+async def read_response(reader):
+    await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, value = line.decode("latin-1").split(":", 1)
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return await reader.readexactly(length)
+
+
+async def run_client(port, images, num_requests, latencies):
+    """
+    Send num_requests predict requests one after another over one connection.
+
+    Parameters
+    ----------
+        port : int
+        images : ndarray
+            uint8 images sent in turn.
+        num_requests : int
+        latencies : list of float
+            seconds of each request are appended here.
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    head = b"POST /predict HTTP/1.1\r\nHost: localhost\r\nContent-Length: 784\r\n\r\n"
+    for index in range(num_requests):
+        start = time.perf_counter()
+        writer.write(head + images[index % len(images)].tobytes())
+        await writer.drain()
+        await read_response(reader)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def run_reloader(port, reloads, total, latencies):
+    """
+    Send reloads POST /reload requests, evenly spread over total predictions.
+
+    Parameters
+    ----------
+        port : int
+        reloads : int
+        total : int
+            number of predict requests of all clients.
+        latencies : list of float
+            filled by run_client, to count finished requests.
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    head = b"POST /reload HTTP/1.1\r\nHost: localhost\r\nContent-Length: 0\r\n\r\n"
+    for reload in range(1, reloads + 1):
+        while len(latencies) < total * reload // (reloads + 1):
+            await asyncio.sleep(0.001)
+        writer.write(head)
+        await writer.drain()
+        await read_response(reader)
+    writer.close()
+
+
+async def run_load(
+    predict_fn,
+    max_batch_size,
+    max_delay,
+    concurrency,
+    num_requests,
+    cache_size=0,
+    version=None,
+    load=None,
+    reloads=0,
+):
+    """
+    Start a server and measure it with concurrent clients.
+
+    Parameters
+    ----------
+        predict_fn : callable
+        max_batch_size : int
+        max_delay : float
+        concurrency : int
+            number of clients sending at the same time.
+        num_requests : int
+            requests per client.
+        cache_size : int
+            size of PredictionCache in front of the batcher, 0 for none.
+        version : string or None
+            weights version of predict_fn.
+        load : callable or None
+            returns (predict_fn, version) for POST /reload.
+        reloads : int
+            number of reloads during the load.
+
+    Returns
+    -------
+        stats : dict
+    """
+    batcher = MicroBatcher(predict_fn, max_batch_size, max_delay)
+    cache = PredictionCache(cache_size, version) if cache_size > 0 else None
+    server = await start_server(batcher, port=0, cache=cache, load=load)
+    port = server.sockets[0].getsockname()[1]
+
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, (DISTINCT_IMAGES, 28, 28, 1), dtype=np.uint8)
+    latencies = []
+
+    start = time.perf_counter()
+    reloader = []
+    if load is not None and reloads > 0:
+        reloader.append(
+            run_reloader(port, reloads, concurrency * num_requests, latencies)
+        )
+    await asyncio.gather(
+        *[
+            run_client(port, images, num_requests, latencies)
+            for _ in range(concurrency)
+        ],
+        *reloader,
+    )
+    seconds = time.perf_counter() - start
+
+    server.close()
+    await server.wait_closed()
+    batcher.close()
+
+    latencies = np.asarray(latencies) * 1000.0
+    return {
+        "max_batch_size": max_batch_size,
+        "max_delay_ms": max_delay * 1000.0,
+        "requests_per_second": len(latencies) / seconds,
+        "mean_batch_size": batcher.requests / max(batcher.batches, 1),
+        "p50_latency_ms": float(np.percentile(latencies, 50)),
+        "p99_latency_ms": float(np.percentile(latencies, 99)),
+        "saved_rate": cache.stats()["saved_rate"] if cache is not None else 0.0,
+        "invalidations": cache.invalidations if cache is not None else 0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark serve.py.")
+    parser.add_argument("--weights", help="trained weights. random if not given")
+    parser.add_argument(
+        "--architecture", choices=ARCHITECTURE_NAMES, default=ARCHITECTURE
+    )
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--delays", type=float, nargs="+", default=DELAYS)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--requests", type=int, default=REQUESTS_PER_CLIENT)
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=0,
+        help="put a prediction cache in front of the model. clients cycle "
+        "through {} distinct images".format(DISTINCT_IMAGES),
+    )
+    parser.add_argument(
+        "--reloads",
+        type=int,
+        default=0,
+        help="POST /reload this many times during each run. without --weights "
+        "every reload draws new random weights and invalidates the cache",
+    )
+    args = parser.parse_args()
+
+    predict_fn, version = make_model_predict_fn(args.weights, args.architecture)
+
+    print(
+        "{:>10}{:>10}{:>12}{:>12}{:>10}{:>10}{:>10}{:>15}".format(
+            "batch",
+            "delay(ms)",
+            "req/sec",
+            "mean batch",
+            "p50(ms)",
+            "p99(ms)",
+            "saved",
+            "invalidations",
+        )
+    )
+    for max_batch_size in args.batch_sizes:
+        for max_delay in args.delays:
+            stats = asyncio.run(
+                run_load(
+                    predict_fn,
+                    max_batch_size,
+                    max_delay,
+                    args.concurrency,
+                    args.requests,
+                    args.cache_size,
+                    version,
+                    lambda: make_model_predict_fn(args.weights, args.architecture),
+                    args.reloads,
+                )
+            )
+            print(
+                "{max_batch_size:>10}{max_delay_ms:>10.1f}{requests_per_second:>12.0f}"
+                "{mean_batch_size:>12.1f}{p50_latency_ms:>10.2f}"
+                "{p99_latency_ms:>10.2f}{saved_rate:>10.2f}"
+                "{invalidations:>15}".format(**stats)
+            )
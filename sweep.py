@@ -0,0 +1,387 @@
+"""Module for searching hyperparameters with parallel trials and successive halving."""
+import os
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from config import TRAIN_DATA_PATH
+from config import VALIDATION_NUM
+
+
+SWEEP_DIR = "./data/sweep"
+MIN_EPOCHS = 1
+MAX_EPOCHS = 27
+ETA = 3
+PARAMETERS = ("learning_rate", "batch_size", "accumulation_steps", "architecture")
+DEFAULT_SPACE = {
+    "learning_rate": [0.0003, 0.001, 0.003, 0.01],
+    "batch_size": [16, 64, 256],
+}
+
+
+def parse_value(text):
+    for parse in (int, float):
+        try:
+            return parse(text)
+        except ValueError:
+            pass
+    return text
+
+
+def parse_space(specs):
+    """
+    Parse search space from command line.
+
+    Parameters
+    ----------
+        specs : list of string
+            "name=a,b,c" to choose from values, "name=low:high" to draw
+            log-uniformly from a range in random search.
+
+    Returns
+    -------
+        space : dict
+            name: list of values or (low, high) tuple.
+    """
+    space = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in PARAMETERS:
+            raise ValueError(
+                "parameter must be one of {}, got {}".format(PARAMETERS, name)
+            )
+        if ":" in values:
+            low, high = values.split(":")
+            space[name] = (float(low), float(high))
+        else:
+            space[name] = [parse_value(value) for value in values.split(",")]
+    return space
+
+
+def make_trials(space, samples=0, seed=0):
+    """
+    Make parameters of every trial.
+
+    Parameters
+    ----------
+        space : dict
+            returned by parse_space.
+        samples : int
+            number of random trials. 0 for every combination of a grid.
+        seed : int
+
+    Returns
+    -------
+        trials : list of dict
+    """
+    if samples <= 0:
+        if any(isinstance(values, tuple) for values in space.values()):
+            raise ValueError("ranges need random search, set samples")
+        names = list(space)
+        return [
+            dict(zip(names, values))
+            for values in itertools.product(*(space[name] for name in names))
+        ]
+
+    rng = random.Random(seed)
+    trials = []
+    for _ in range(samples):
+        trial = {}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                low, high = values
+                value = math.exp(rng.uniform(math.log(low), math.log(high)))
+                trial[name] = round(value) if name != "learning_rate" else value
+            else:
+                trial[name] = rng.choice(values)
+        trials.append(trial)
+    return trials
+
+
+def get_rungs(min_epochs=MIN_EPOCHS, max_epochs=MAX_EPOCHS, eta=ETA):
+    """
+    Epoch budgets of successive halving, growing by eta up to max_epochs.
+
+    Returns
+    -------
+        rungs : list of int
+    """
+    rungs = []
+    epochs = min_epochs
+    while epochs < max_epochs:
+        rungs.append(epochs)
+        epochs *= eta
+    rungs.append(max_epochs)
+    return rungs
+
+
+def init_worker(cpu_slices, threads):
+    """
+    Pin worker process to its own cpus and thread count.
+
+    Must run before tensorflow creates its thread pools.
+
+    Parameters
+    ----------
+        cpu_slices : multiprocessing.Queue
+            one list of cpu ids per worker.
+        threads : int
+    """
+    cpus = cpu_slices.get()
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def run_trial(trial_dir, params, epochs, train_path, validation_num):
+    """
+    Train one trial up to epochs, continuing from its last checkpoint.
+
+    Parameters
+    ----------
+        trial_dir : string
+            checkpoint directory of the trial.
+        params : dict
+            keyword arguments of main.build_training.
+        epochs : int
+            epoch budget of the rung.
+        train_path : string
+        validation_num : int
+
+    Returns
+    -------
+        result : dict
+            epoch, losses and accuracies of the last epoch and seconds spent.
+    """
+    import main
+    from checkpoint import Checkpointer
+    from utils import get_data
+    from utils import get_memmap_dataset
+    from utils import split_validation
+
+    start = time.perf_counter()
+    batch_size = params.get("batch_size", main.BATCH_SIZE)
+    model, loss_object, optimizer, metrics_loss, metrics_accuracy = (
+        main.build_training(**params)
+    )
+
+    # Every trial maps the same cache files instead of loading its own copy.
+    features, label = get_data(train_path)
+    (
+        train_features,
+        train_label,
+        validation_features,
+        validation_label,
+    ) = split_validation(features, label, validation_num)
+    train_dataset = get_memmap_dataset(train_features, train_label, batch_size)
+    validation_dataset = get_memmap_dataset(
+        validation_features, validation_label, batch_size, shuffle=False
+    )
+
+    checkpointer = Checkpointer(trial_dir, model, optimizer, max_to_keep=1)
+    record = main.train(
+        train_dataset,
+        validation_dataset,
+        model,
+        loss_object,
+        optimizer,
+        epochs,
+        metrics_loss,
+        metrics_accuracy,
+        metrics_loss,
+        metrics_accuracy,
+        steps_per_execution=main.STEPS_PER_EXECUTION,
+        checkpointer=checkpointer,
+        initial_epoch=checkpointer.restore(),
+    )
+
+    return {
+        "epoch": record["epoch"],
+        "train_loss": record["train_loss"],
+        "train_accuracy": record["train_accuracy"],
+        "validation_loss": record["validation_loss"],
+        "validation_accuracy": record["validation_accuracy"],
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def sweep(
+    trials,
+    rungs,
+    workers,
+    threads,
+    train_path=TRAIN_DATA_PATH,
+    validation_num=VALIDATION_NUM,
+    sweep_dir=SWEEP_DIR,
+    eta=ETA,
+):
+    """
+    Run trials in parallel, keeping the best 1 / eta of them after every rung.
+
+    Parameters
+    ----------
+        trials : list of dict
+            returned by make_trials.
+        rungs : list of int
+            returned by get_rungs.
+        workers : int
+            number of worker processes.
+        threads : int
+            number of cpus of each worker.
+        train_path : string
+        validation_num : int
+        sweep_dir : string
+            directory of trial checkpoints and results.json.
+        eta : int
+
+    Returns
+    -------
+        results : list of dict
+            params, history of rung results and the epoch the trial was
+            stopped at, for every trial.
+    """
+    from utils import get_data
+
+    # Write the cache once, before workers race to build it.
+    get_data(train_path)
+
+    results = [{"params": params, "history": [], "stopped": None} for params in trials]
+    trial_dirs = [
+        os.path.join(sweep_dir, "trial_{:03d}".format(index))
+        for index in range(len(trials))
+    ]
+    for trial_dir in trial_dirs:
+        shutil.rmtree(trial_dir, ignore_errors=True)
+
+    context = multiprocessing.get_context("spawn")
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    cpu_slices = context.Queue()
+    for worker in range(workers):
+        cpu_slices.put(cpus[worker * threads : (worker + 1) * threads])
+
+    alive = list(range(len(trials)))
+    with ProcessPoolExecutor(
+        workers,
+        mp_context=context,
+        initializer=init_worker,
+        initargs=(cpu_slices, threads),
+    ) as pool:
+        for rung, epochs in enumerate(rungs):
+            futures = {
+                index: pool.submit(
+                    run_trial,
+                    trial_dirs[index],
+                    trials[index],
+                    epochs,
+                    train_path,
+                    validation_num,
+                )
+                for index in alive
+            }
+            for index, future in futures.items():
+                result = future.result()
+                results[index]["history"].append(result)
+                print(
+                    "rung {} trial {:3d} epoch {:3d} accuracy {:.4f} {}".format(
+                        rung,
+                        index,
+                        result["epoch"],
+                        result["validation_accuracy"],
+                        trials[index],
+                    ),
+                    flush=True,
+                )
+
+            if rung == len(rungs) - 1:
+                break
+            alive.sort(
+                key=lambda index: results[index]["history"][-1]["validation_accuracy"],
+                reverse=True,
+            )
+            keep = max(1, len(alive) // eta)
+            for index in alive[keep:]:
+                results[index]["stopped"] = epochs
+                shutil.rmtree(trial_dirs[index], ignore_errors=True)
+            alive = alive[:keep]
+
+    os.makedirs(sweep_dir, exist_ok=True)
+    with open(os.path.join(sweep_dir, "results.json"), "w") as f:
+        json.dump(results, f, indent=1)
+
+    return results
+
+
+def print_results(results):
+    rows = sorted(
+        enumerate(results),
+        # Trials that reached later rungs first, then by accuracy.
+        key=lambda item: (
+            len(item[1]["history"]),
+            item[1]["history"][-1]["validation_accuracy"],
+        ),
+        reverse=True,
+    )
+    print("{:<7}{:>8}{:>10}  {}".format("trial", "epochs", "accuracy", "params"))
+    for index, result in rows:
+        last = result["history"][-1]
+        print(
+            "{:<7}{:>8}{:>10.4f}  {}".format(
+                index, last["epoch"], last["validation_accuracy"], result["params"]
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search hyperparameters.")
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        help="search space of one parameter, name=a,b,c or name=low:high. "
+        "names: {}".format(", ".join(PARAMETERS)),
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=0,
+        help="number of random trials. 0 runs the whole grid",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-epochs", type=int, default=MIN_EPOCHS)
+    parser.add_argument("--max-epochs", type=int, default=MAX_EPOCHS)
+    parser.add_argument("--eta", type=int, default=ETA)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--threads", type=int, help="cpus per worker")
+    parser.add_argument("--train-path", default=TRAIN_DATA_PATH)
+    parser.add_argument("--validation-num", type=int, default=VALIDATION_NUM)
+    parser.add_argument("--sweep-dir", default=SWEEP_DIR)
+    args = parser.parse_args()
+
+    space = parse_space(args.param) if args.param else DEFAULT_SPACE
+    trials_ = make_trials(space, args.samples, args.seed)
+
+    num_cpus = os.cpu_count() or 1
+    threads_ = args.threads or max(1, num_cpus // (args.workers or num_cpus))
+    workers_ = args.workers or max(1, min(len(trials_), num_cpus // threads_))
+
+    results_ = sweep(
+        trials_,
+        get_rungs(args.min_epochs, args.max_epochs, args.eta),
+        workers_,
+        threads_,
+        args.train_path,
+        args.validation_num,
+        args.sweep_dir,
+        args.eta,
+    )
+    print_results(results_)
@@ -1,57 +1,361 @@
 """Module for training model."""
+import warnings
 import tensorflow as tf
 
 
-@tf.function
-def train_epoch(
-    data_loader,
+IMAGE_SPEC = tf.TensorSpec(shape=(None, 28, 28, 1), dtype=tf.float32)
+LABEL_SPEC = tf.TensorSpec(shape=(None,), dtype=tf.int64)
+PRECISION_POLICIES = ("float32", "mixed_bfloat16", "mixed_float16")
+LR_SCALING_RULES = ("none", "linear", "sqrt")
+
+
+def cpu_supports_bfloat16():
+    """
+    Check whether the cpu has native bfloat16 instructions.
+
+    Returns
+    -------
+        supported : boolean
+            False if it cannot be determined.
+    """
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def set_precision(policy):
+    """
+    Set global dtype policy. Must be called before the model is built.
+
+    Parameters
+    ----------
+        policy : string
+            one of PRECISION_POLICIES.
+    """
+    if policy not in PRECISION_POLICIES:
+        raise ValueError(
+            "policy must be one of {}, got {}".format(PRECISION_POLICIES, policy)
+        )
+    if policy == "mixed_bfloat16" and not cpu_supports_bfloat16():
+        warnings.warn("cpu has no native bfloat16 support, mixed_bfloat16 may be slow")
+    tf.keras.mixed_precision.set_global_policy(policy)
+
+
+def scale_learning_rate(learning_rate, batch_size, base_batch_size, rule="linear"):
+    """
+    Scale learning rate tuned for base_batch_size to batch_size.
+
+    Parameters
+    ----------
+        learning_rate : float
+            learning rate at base_batch_size.
+        batch_size : int
+            effective batch size, including gradient accumulation.
+        base_batch_size : int
+        rule : string
+            one of LR_SCALING_RULES. linear suits SGD, sqrt usually suits Adam.
+
+    Returns
+    -------
+        learning_rate : float
+    """
+    if rule not in LR_SCALING_RULES:
+        raise ValueError(
+            "rule must be one of {}, got {}".format(LR_SCALING_RULES, rule)
+        )
+    ratio = batch_size / base_batch_size
+    if rule == "linear":
+        return learning_rate * ratio
+    if rule == "sqrt":
+        return learning_rate * ratio**0.5
+    return learning_rate
+
+
+class WarmupSchedule(tf.keras.optimizers.schedules.LearningRateSchedule):
+    """
+    Learning rate rising linearly from 0 to peak over warmup_steps, then constant.
+
+    Attributes
+    ----------
+        peak : float
+        warmup_steps : int
+            number of optimizer iterations of the warmup.
+    """
+
+    def __init__(self, peak, warmup_steps):
+        super().__init__()
+        self.peak = peak
+        self.warmup_steps = warmup_steps
+
+    def __call__(self, step):
+        step = tf.cast(step, tf.float32) + 1.0
+        return self.peak * tf.minimum(step / float(self.warmup_steps), 1.0)
+
+    def get_config(self):
+        return {"peak": self.peak, "warmup_steps": self.warmup_steps}
+
+
+def make_learning_rate(
+    learning_rate,
+    batch_size,
+    base_batch_size,
+    rule="linear",
+    warmup_steps=0,
+    accumulation_steps=1,
+):
+    """
+    Make learning rate for large batches.
+
+    Parameters
+    ----------
+        learning_rate : float
+            learning rate tuned for base_batch_size.
+        batch_size : int
+            batch size of one step.
+        base_batch_size : int
+        rule : string
+            one of LR_SCALING_RULES.
+        warmup_steps : int
+            number of weight updates of the warmup. 0 for no warmup.
+        accumulation_steps : int
+            number of batches whose gradients make one weight update.
+
+    Returns
+    -------
+        learning_rate : float or WarmupSchedule
+    """
+    peak = scale_learning_rate(
+        learning_rate, batch_size * accumulation_steps, base_batch_size, rule
+    )
+    if warmup_steps <= 0:
+        return peak
+    # Optimizer iterations count batches, not weight updates.
+    return WarmupSchedule(peak, warmup_steps * accumulation_steps)
+
+
+def make_optimizer(learning_rate, loss_scale=False, accumulation_steps=1):
+    """
+    Make Adam optimizer, wrapped for loss scaling if needed.
+
+    Parameters
+    ----------
+        learning_rate : float or tf.keras.optimizers.schedules.LearningRateSchedule
+        loss_scale : boolean
+            whether to scale loss dynamically to keep small float16 gradients.
+        accumulation_steps : int
+            number of batches whose averaged gradients make one weight update.
+            the gradients are kept in optimizer variables, so they are saved
+            by Checkpointer too.
+
+    Returns
+    -------
+        optimizer : tf.keras.optimizers
+    """
+    optimizer = tf.keras.optimizers.Adam(
+        learning_rate,
+        gradient_accumulation_steps=accumulation_steps if accumulation_steps > 1 else None,
+    )
+    if loss_scale:
+        optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+    return optimizer
+
+
+def make_train_step(
     model,
     loss_object,
     optimizer,
     train_metrics_loss,
     train_metrics_accuracy,
+    steps_per_execution=1,
+    strategy=None,
+    jit_compile=False,
 ):
     """
-    Function for training model in one epoch.
+    Build a compiled function that trains model on batches.
 
     Parameters
     ----------
-        data_loader : tf.data.Dataset
-            dataset for training.
         model : tf.keras.Model
             model that will be trained.
         loss_object : tf.keras.losses
         optimizer : tf.keras.optimizers
         train_metrics_loss : tf.keras.metrics
         train_metrics_accuracy : tf.keras.metrics
+        steps_per_execution : int
+            number of batches run by one call of the returned function.
+        strategy : tf.distribute.Strategy or None
+            if given, every batch is run on the replicas of strategy. model,
+            optimizer and metrics must be created in strategy.scope().
+        jit_compile : boolean
+            whether to compile the step with XLA.
 
     Returns
     -------
-        train_loss : scalar tensor
-            loss during train.
-        train_accuracy : scalar tensor
-            accuracy during train.
+        train_step : tf.function
+            if steps_per_execution is 1, takes (images, labels) of one batch.
+            otherwise takes an iterator of the dataset, runs up to
+            steps_per_execution batches and returns the number of batches run.
     """
-    # Reset the metrics at the start of epoch.
-    train_metrics_loss.reset_state()
-    train_metrics_accuracy.reset_state()
+    num_replicas = 1 if strategy is None else strategy.num_replicas_in_sync
 
-    # Train model.
-    for images, labels in data_loader:
+    def step(images, labels):
         with tf.GradientTape() as tape:
             predictions = model(images, training=True)
+            # Inside a strategy keras already divides the mean loss by the
+            # number of replicas, so the summed gradients are averaged.
             loss = loss_object(labels, predictions)
-        gradients = tape.gradient(loss, model.trainable_variables)
+            # Multiplied by the loss scale of LossScaleOptimizer, 1 otherwise.
+            scaled_loss = optimizer.scale_loss(loss)
+        gradients = tape.gradient(scaled_loss, model.trainable_variables)
         optimizer.apply_gradients(zip(gradients, model.trainable_variables))
 
-        # Update state of metircs.
-        train_metrics_loss(loss)
+        # Update state of metircs with the mean loss of this replica's batch.
+        train_metrics_loss(loss * num_replicas)
         train_metrics_accuracy(labels, predictions)
 
-    train_loss = train_metrics_loss.result()
-    train_accuracy = train_metrics_accuracy.result()
+    return compile_step(step, steps_per_execution, strategy, jit_compile)
+
+
+def compile_step(step, steps_per_execution=1, strategy=None, jit_compile=False):
+    """
+    Compile step into the function returned by make_train_step or make_eval_step.
+
+    Parameters
+    ----------
+        step : callable
+            function taking (images, labels) of one batch.
+        steps_per_execution : int
+        strategy : tf.distribute.Strategy or None
+        jit_compile : boolean
+            whether to compile step with XLA. the loop over batches is not
+            compiled with XLA, since XLA cannot read from iterators.
+
+    Returns
+    -------
+        step : tf.function
+    """
+    if jit_compile:
+        step = tf.function(step, jit_compile=True)
+
+    if strategy is not None:
+        replica_step = step
+
+        def step(images, labels):
+            strategy.run(replica_step, args=(images, labels))
+
+        # Distributed batches have no fixed signature.
+        if steps_per_execution == 1:
+            return tf.function(step)
+    elif steps_per_execution == 1:
+        return tf.function(step, input_signature=[IMAGE_SPEC, LABEL_SPEC])
+
+    return make_multi_step(step, steps_per_execution)
+
+
+def make_multi_step(step, steps_per_execution):
+    """
+    Wrap step into a compiled function running several batches per call.
+
+    Parameters
+    ----------
+        step : callable
+            function taking (images, labels) of one batch.
+        steps_per_execution : int
+            maximum number of batches run by one call.
+
+    Returns
+    -------
+        multi_step : tf.function
+            takes an iterator of the dataset and returns the number of batches run.
+    """
+
+    @tf.function
+    def multi_step(iterator):
+        steps = tf.constant(0)
+        for _ in tf.range(steps_per_execution):
+            element = iterator.get_next_as_optional()
+            if not element.has_value():
+                break
+            images, labels = element.get_value()
+            step(images, labels)
+            steps += 1
+        return steps
+
+    return multi_step
+
+
+def run_steps(data_loader, step, steps_per_execution=1, on_step=None):
+    """
+    Run a compiled step function over every batch of data_loader.
+
+    Parameters
+    ----------
+        data_loader : tf.data.Dataset
+        step : tf.function
+            function built by make_train_step or make_eval_step.
+        steps_per_execution : int
+            the value step was built with.
+        on_step : callable or None
+            called with the number of batches run after every call of step.
+    """
+    if steps_per_execution == 1:
+        for images, labels in data_loader:
+            step(images, labels)
+            if on_step is not None:
+                on_step(1)
+        return
+
+    iterator = iter(data_loader)
+    while True:
+        steps = int(step(iterator))
+        if on_step is not None and steps > 0:
+            on_step(steps)
+        if steps < steps_per_execution:
+            break
+
+
+def train_epoch(
+    data_loader,
+    train_step,
+    train_metrics_loss,
+    train_metrics_accuracy,
+    steps_per_execution=1,
+    on_step=None,
+):
+    """
+    Function for training model in one epoch.
+
+    Parameters
+    ----------
+        data_loader : tf.data.Dataset
+            dataset for training.
+        train_step : tf.function
+            function built by make_train_step.
+        train_metrics_loss : tf.keras.metrics
+        train_metrics_accuracy : tf.keras.metrics
+        steps_per_execution : int
+            the value train_step was built with.
+        on_step : callable or None
+            called with the number of batches run after every call of train_step.
+
+    Returns
+    -------
+        train_loss : float
+            loss during train.
+        train_accuracy : float
+            accuracy during train.
+    """
+    # Reset the metrics at the start of epoch.
+    train_metrics_loss.reset_state()
+    train_metrics_accuracy.reset_state()
+
+    # Train model.
+    run_steps(data_loader, train_step, steps_per_execution, on_step)
 
-    train_loss = train_loss.numpy()
-    train_accuracy = train_accuracy.numpy()
+    train_loss = float(train_metrics_loss.result().numpy())
+    train_accuracy = float(train_metrics_accuracy.result().numpy())
 
     return train_loss, train_accuracy
@@ -1,13 +1,68 @@
 """Module for loading csv data, converting it into numpy array, and checking whether data is loaded properly."""
-import pandas as pd
+import os
+import json
+import hashlib
 import numpy as np
 import tensorflow as tf
-from PIL import Image
+from augmentation import augment_dataset
 
 
-def get_data(path):
+CACHE_VERSION = 1
+PIXEL_SCALE = 255.0
+SHUFFLE_BUFFER = 10000
+
+
+def file_digest(path, chunk_size=1 << 20):
     """
-    Function for loading data from csv file
+    Compute hash of a file.
+
+    Parameters
+    ----------
+        path : string
+        chunk_size : int
+            number of bytes read at once.
+
+    Returns
+    -------
+        digest : string
+            hex digest of the file content.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_cache_paths(path, cache_dir=None):
+    """
+    Get paths of the cache files for a csv file.
+
+    Parameters
+    ----------
+        path : string
+            path of the data(csv).
+        cache_dir : string or None
+            directory of cache. default is ".cache" next to the csv file.
+
+    Returns
+    -------
+        header_path : string
+        features_path : string
+        label_path : string
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(path), ".cache")
+    name = os.path.basename(path)
+    header_path = os.path.join(cache_dir, name + ".json")
+    features_path = os.path.join(cache_dir, name + ".features.npy")
+    label_path = os.path.join(cache_dir, name + ".label.npy")
+    return header_path, features_path, label_path
+
+
+def read_csv(path):
+    """
+    Parse csv file into uint8 arrays.
 
     Parameters
     ----------
@@ -17,23 +72,153 @@ def get_data(path):
     Returns
     -------
         features : ndarray
-            data of MNIST. shape = (, 28, 28, 1)
-        label : ndarray
-            label of MNIST. shape = (,)
+            data of MNIST. shape = (, 28, 28, 1), dtype = uint8
+        label : ndarray or None
+            label of MNIST. shape = (,), dtype = uint8. None if csv has no label.
     """
-    # Load train.csv by using pandas
-    data = pd.read_csv(path)
+    # Load csv by using pandas. Every value is a pixel or a digit.
+    # Imported here since cached loads do not need pandas.
+    import pandas as pd
+
+    data = pd.read_csv(path, dtype=np.uint8)
 
     # Separate label from csv data
-    features = data.copy()
-    label = features.pop("label")
+    label = None
+    if "label" in data.columns:
+        label = data.pop("label").to_numpy()
+
+    # Change the shape of features from (, 784) to (, 28, 28, 1)
+    features = np.reshape(data.to_numpy(), (-1, 28, 28, 1))
+
+    return features, label
+
+
+def save_atomically(path, array):
+    """
+    Save array as npy file that other processes see either whole or not at all.
+
+    Writing in place would truncate a file that another process has
+    memory-mapped, so the array goes to a temporary file that then replaces
+    path.
+
+    Parameters
+    ----------
+        path : string
+        array : ndarray
+    """
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(temp_path, path)
+
+
+def write_cache(path, cache_dir=None):
+    """
+    Parse csv file and write it as memory-mappable npy files.
+
+    Parameters
+    ----------
+        path : string
+            path of the data(csv).
+        cache_dir : string or None
+
+    Returns
+    -------
+        header : dict
+            shape, dtype and source hash of the cached data.
+    """
+    header_path, features_path, label_path = get_cache_paths(path, cache_dir)
+    os.makedirs(os.path.dirname(header_path), exist_ok=True)
+
+    digest = file_digest(path)
+    features, label = read_csv(path)
+
+    save_atomically(features_path, features)
+    if label is not None:
+        save_atomically(label_path, label)
+
+    header = {
+        "version": CACHE_VERSION,
+        "source": os.path.abspath(path),
+        "source_hash": digest,
+        "shape": list(features.shape),
+        "dtype": str(features.dtype),
+        "has_label": label is not None,
+    }
+
+    # Write header last so a partially written cache is never used.
+    temp_path = "{}.{}.tmp".format(header_path, os.getpid())
+    with open(temp_path, "w") as f:
+        json.dump(header, f)
+    os.replace(temp_path, header_path)
+
+    return header
+
+
+def read_cache_header(path, cache_dir=None):
+    """
+    Read header of the cache if it is valid for the csv file.
+
+    Parameters
+    ----------
+        path : string
+            path of the data(csv).
+        cache_dir : string or None
+
+    Returns
+    -------
+        header : dict or None
+            None if there is no cache or the csv file has changed.
+    """
+    header_path, _, _ = get_cache_paths(path, cache_dir)
+    try:
+        with open(header_path) as f:
+            header = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if header.get("version") != CACHE_VERSION:
+        return None
+    if header.get("source_hash") != file_digest(path):
+        return None
+    return header
+
+
+def get_data(path, use_cache=True, cache_dir=None):
+    """
+    Function for loading data from csv file
+
+    On first load the csv file is parsed and saved as uint8 npy files. Later
+    loads memory-map those files without copying, until the csv file changes.
+
+    Parameters
+    ----------
+        path : string
+            path of the data(csv).
+        use_cache : boolean
+            whether to use the binary cache.
+        cache_dir : string or None
+            directory of cache. default is ".cache" next to the csv file.
+
+    Returns
+    -------
+        features : ndarray
+            data of MNIST. shape = (, 28, 28, 1), dtype = uint8
+        label : ndarray or None
+            label of MNIST. shape = (,), dtype = uint8
+    """
+    if not use_cache:
+        return read_csv(path)
 
-    # Change type of features and label into ndarray
-    features = np.array(features)
-    label = np.array(label)
+    header = read_cache_header(path, cache_dir)
+    if header is None:
+        header = write_cache(path, cache_dir)
 
-    # Change the shape of train features from (, 784) to (, 28, 28)
-    features = np.reshape(features, (-1, 28, 28, 1))
+    _, features_path, label_path = get_cache_paths(path, cache_dir)
+    features = np.load(features_path, mmap_mode="r")
+    label = None
+    if header["has_label"]:
+        label = np.load(label_path, mmap_mode="r")
 
     return features, label
 
@@ -67,48 +252,267 @@ def split_validation(features, label, validation_num):
     return train_features, train_label, validation_features, validation_label
 
 
-def preprocess(data):
+def normalize(images, labels):
     """
-    Function for preprocessing image data.
+    Cast a batch of uint8 images to float32 and scale it into [0, 1].
 
     Parameters
     ----------
-        data : ndarray
-            image data.
+        images : tensor
+            uint8 image batch.
+        labels : tensor
+            label batch.
 
     Returns
     -------
-        preprocessed : ndarray
-            preprocessed image data.
+        images : tensor
+            float32 image batch.
+        labels : tensor
+            int64 label batch.
     """
-    preprocessed = data / 225.0
-    return preprocessed
+    images = tf.cast(images, tf.float32) / PIXEL_SCALE
+    labels = tf.cast(labels, tf.int64)
+    return images, labels
+
+
+def get_dataset(
+    features,
+    label,
+    batch_size,
+    shuffle=True,
+    num_shards=1,
+    shard_index=0,
+    augment=False,
+    seed=None,
+):
+    """
+    Change list(ndarray) into tensorflow Dataset.
 
+    Images stay uint8 until a batch is formed and are normalized batch by batch.
 
-def get_dataset(features, label, batch_size):
+    Parameters
+    ----------
+        features : ndarray
+            uint8 image data.
+        label : ndarray
+        batch_size : int
+        shuffle : boolean
+        num_shards : int
+            number of workers the data is split between.
+        shard_index : int
+            index of the shard kept by this worker. every shard has the same
+            number of rows, so every worker runs the same number of steps.
+        augment : boolean
+            whether to randomly distort, rotate and shift every batch.
+        seed : int or None
+            seed of shuffling and augmentation, for reproducible runs.
+
+    Returns
+    -------
+        dataset : tf.data.Dataset
     """
-    Change list(ndarray) into tensorflow Dataset.
+    if num_shards > 1:
+        shard_size = len(label) // num_shards
+        features = features[shard_index::num_shards][:shard_size]
+        label = label[shard_index::num_shards][:shard_size]
+
+    dataset = tf.data.Dataset.from_tensor_slices((features, label))
+    if shuffle:
+        dataset = dataset.shuffle(SHUFFLE_BUFFER, seed=seed)
+    dataset = dataset.batch(batch_size).map(
+        normalize, num_parallel_calls=tf.data.AUTOTUNE
+    )
+    if augment:
+        dataset = augment_dataset(dataset, seed)
+    dataset = dataset.prefetch(tf.data.AUTOTUNE)
+
+    return dataset
+
+
+def get_memmap_dataset(
+    features, label, batch_size, shuffle=True, seed=None, indices=None
+):
+    """
+    Build a dataset reading batches straight from memory-mapped arrays.
+
+    Unlike get_dataset, the arrays are not copied into the graph, so processes
+    mapping the same cache files or shared memory share one copy of the data.
 
     Parameters
     ----------
         features : ndarray
+            uint8 image data, e.g. memory-mapped by get_data.
         label : ndarray
         batch_size : int
+        shuffle : boolean
+        seed : int or None
+        indices : ndarray or None
+            rows to read, e.g. one fold. every row if None.
 
     Returns
     -------
         dataset : tf.data.Dataset
     """
+    if indices is None:
+        indices = np.arange(len(label))
+    dataset = tf.data.Dataset.from_tensor_slices(indices.astype(np.int64))
+
+    def gather(indices):
+        return features[indices], label[indices]
+
+    def read_batch(indices):
+        images, labels = tf.numpy_function(
+            gather, [indices], (features.dtype, label.dtype)
+        )
+        images.set_shape((None,) + features.shape[1:])
+        labels.set_shape((None,))
+        return images, labels
+
+    if shuffle:
+        # Shuffling indices is cheap, so shuffle all of them.
+        dataset = dataset.shuffle(len(indices), seed=seed)
     dataset = (
-        tf.data.Dataset.from_tensor_slices((features, label))
-        .shuffle(10000)
-        .batch(batch_size)
+        dataset.batch(batch_size)
+        .map(read_batch, num_parallel_calls=tf.data.AUTOTUNE)
+        .map(normalize, num_parallel_calls=tf.data.AUTOTUNE)
+        .prefetch(tf.data.AUTOTUNE)
+    )
+
+    return dataset
+
+
+def get_csv_lines(path):
+    """
+    Read rows of csv files lazily as strings, without header.
+
+    Parameters
+    ----------
+        path : string or list of string
+            path of the data(csv).
+
+    Returns
+    -------
+        lines : tf.data.Dataset
+            one string per row.
+    """
+    if isinstance(path, str):
+        return tf.data.TextLineDataset(path).skip(1)
+
+    return tf.data.Dataset.from_tensor_slices(list(path)).flat_map(
+        lambda file_path: tf.data.TextLineDataset(file_path).skip(1)
+    )
+
+
+def decode_rows(lines, labeled=True):
+    """
+    Parse a batch of csv rows into images and labels.
+
+    Parameters
+    ----------
+        lines : tensor
+            string batch, one csv row each.
+        labeled : boolean
+            whether the first column is the label.
+
+    Returns
+    -------
+        images : tensor
+            uint8 image batch. shape = (, 28, 28, 1)
+        labels : tensor
+            uint8 label batch. only returned if labeled is True.
+    """
+    values = tf.strings.to_number(tf.strings.split(lines, ","), tf.int32)
+    values = tf.cast(values.to_tensor(), tf.uint8)
+
+    if not labeled:
+        return tf.reshape(values, (-1, 28, 28, 1))
+
+    images = tf.reshape(values[:, 1:], (-1, 28, 28, 1))
+    labels = values[:, 0]
+    return images, labels
+
+
+def get_csv_dataset(
+    lines, batch_size, labeled=True, shuffle=True, augment=False, seed=None
+):
+    """
+    Build a dataset that parses csv rows batch by batch.
+
+    Parameters
+    ----------
+        lines : tf.data.Dataset
+            rows returned by get_csv_lines.
+        batch_size : int
+        labeled : boolean
+            whether the first column is the label.
+        shuffle : boolean
+            whether to shuffle rows within a buffer of SHUFFLE_BUFFER rows.
+        augment : boolean
+            whether to randomly distort, rotate and shift every batch.
+            only used if labeled is True.
+        seed : int or None
+            seed of shuffling and augmentation.
+
+    Returns
+    -------
+        dataset : tf.data.Dataset
+    """
+    if shuffle:
+        lines = lines.shuffle(SHUFFLE_BUFFER, seed=seed)
+
+    dataset = lines.batch(batch_size).map(
+        lambda batch: decode_rows(batch, labeled),
+        num_parallel_calls=tf.data.AUTOTUNE,
     )
+    if labeled:
+        dataset = dataset.map(normalize, num_parallel_calls=tf.data.AUTOTUNE)
+        if augment:
+            dataset = augment_dataset(dataset, seed)
+    dataset = dataset.prefetch(tf.data.AUTOTUNE)
 
     return dataset
 
 
-def get_train_dataset(path, validation_num, batch_size):
+def get_streaming_train_dataset(
+    path, validation_num, batch_size, augment=False, seed=None
+):
+    """
+    Get train dataset and validation data from path without loading it in memory.
+
+    Rows are read lazily. The first validation_num rows are used for
+    validation, same as split_validation.
+
+    Parameters
+    ----------
+        path : string or list of string
+            path of the data(csv).
+        validation_num : int
+            number of validation data.
+        batch_size : int
+        augment : boolean
+            whether to augment the train dataset.
+        seed : int or None
+
+    Returns
+    -------
+        train_dataset : tf.data.Dataset
+        validation_dataset : tf.data.Dataset
+    """
+    lines = get_csv_lines(path)
+
+    train_dataset = get_csv_dataset(
+        lines.skip(validation_num), batch_size, augment=augment, seed=seed
+    )
+    validation_dataset = get_csv_dataset(
+        lines.take(validation_num), batch_size, shuffle=False
+    )
+
+    return train_dataset, validation_dataset
+
+
+def get_train_dataset(
+    path, validation_num, batch_size, streaming=False, augment=False, seed=None
+):
     """
     Get train dataset and validation data from path:
 
@@ -119,15 +523,25 @@ def get_train_dataset(path, validation_num, batch_size):
         validation_num : int
             number of validation data.
         batcb_size : int
+        streaming : boolean
+            whether to read the csv lazily instead of loading it in memory.
+        augment : boolean
+            whether to augment the train dataset. validation data is never
+            augmented.
+        seed : int or None
+            seed of shuffling and augmentation.
 
     Returns
     -------
         train_dataset : tf.keras.Dataset
         validation_dataset : tf.keras.Dataset
     """
-    features, label = get_data(path)
+    if streaming:
+        return get_streaming_train_dataset(
+            path, validation_num, batch_size, augment, seed
+        )
 
-    features = preprocess(features)
+    features, label = get_data(path)
 
     (
         train_features,
@@ -136,9 +550,11 @@ def get_train_dataset(path, validation_num, batch_size):
         validation_label,
     ) = split_validation(features, label, validation_num)
 
-    train_dataset = get_dataset(train_features, train_label, batch_size)
+    train_dataset = get_dataset(
+        train_features, train_label, batch_size, augment=augment, seed=seed
+    )
     validation_dataset = get_dataset(
-        validation_features, validation_label, batch_size
+        validation_features, validation_label, batch_size, shuffle=False
     )
 
     return train_dataset, validation_dataset
@@ -146,6 +562,8 @@ def get_train_dataset(path, validation_num, batch_size):
 
 # For debugging
 if __name__ == "__main__":
+    from PIL import Image
+
     images, labels = get_data("./data/train.csv")
 
     print(images.shape)
@@ -1,67 +1,187 @@
 import tensorflow as tf
+from training import compile_step
+from training import run_steps
 
 
-@tf.function
-def test_epoch(
-    data_loader,
+class ValidationSampler:
+    """
+    A class to pick random validation examples during evaluation.
+
+    Every example gets a random score and the examples with the k highest
+    scores are kept, so the kept examples are a uniform sample of everything
+    seen since the last reset. Runs inside the compiled eval step.
+
+    Attributes
+    ----------
+        sample_size : int
+            number of examples kept.
+        scores : tf.Variable
+        images : tf.Variable
+        labels : tf.Variable
+        predictions : tf.Variable
+
+    Methods
+    -------
+        reset_state():
+            forget kept examples.
+        update_state(images, labels, logits):
+            offer a batch of examples.
+        result():
+            return kept images, labels and predictions as ndarray.
+    """
+
+    def __init__(self, sample_size=1):
+        """
+        Initialize sampler.
+
+        Parameters
+        ----------
+            sample_size : int
+                number of examples kept.
+        """
+        self.sample_size = sample_size
+        self.scores = tf.Variable(
+            tf.fill([sample_size], float("-inf")), trainable=False
+        )
+        self.images = tf.Variable(
+            tf.zeros((sample_size, 28, 28, 1)), trainable=False
+        )
+        self.labels = tf.Variable(
+            tf.zeros((sample_size,), tf.int64), trainable=False
+        )
+        self.predictions = tf.Variable(
+            tf.zeros((sample_size,), tf.int64), trainable=False
+        )
+
+    def reset_state(self):
+        self.scores.assign(tf.fill([self.sample_size], float("-inf")))
+
+    def update_state(self, images, labels, logits):
+        scores = tf.concat(
+            [self.scores, tf.random.uniform(tf.shape(labels)[:1])], axis=0
+        )
+        index = tf.math.top_k(scores, k=self.sample_size).indices
+
+        self.scores.assign(tf.gather(scores, index))
+        self.images.assign(
+            tf.gather(tf.concat([self.images, images], axis=0), index)
+        )
+        self.labels.assign(
+            tf.gather(tf.concat([self.labels, labels], axis=0), index)
+        )
+        self.predictions.assign(
+            tf.gather(
+                tf.concat(
+                    [self.predictions, tf.math.argmax(logits, axis=-1)], axis=0
+                ),
+                index,
+            )
+        )
+
+    def result(self):
+        kept = self.scores.numpy() > float("-inf")
+        return (
+            self.images.numpy()[kept],
+            self.labels.numpy()[kept],
+            self.predictions.numpy()[kept],
+        )
+
+
+def make_eval_step(
     model,
     loss_object,
     test_metrics_loss,
     test_metrics_accuracy,
+    steps_per_execution=1,
+    sampler=None,
+    strategy=None,
+    jit_compile=False,
 ):
     """
-    Function for testing(validation) model in one epoch.
+    Build a compiled function that evaluates model on batches.
 
     Parameters
     ----------
-        data_loader : tf.data.Dataset
-            dataset for testing.
         model : tf.keras.Model
             model that will be tested.
         loss_object : tf.keras.losses
         test_metrics_loss : tf.keras.metrics
         test_metrics_accuracy : tf.keras.metrics
+        steps_per_execution : int
+            number of batches run by one call of the returned function.
+        sampler : ValidationSampler or None
+            sampler offered every evaluated example. not supported with strategy.
+        strategy : tf.distribute.Strategy or None
+            if given, every batch is run on the replicas of strategy.
+        jit_compile : boolean
+            whether to compile the step with XLA.
 
     Returns
     -------
-        test_loss : scalar tensor
-            loss during test.
-        test_accuracy : scalar tensor
-            accuracy during test.
+        eval_step : tf.function
+            same calling convention as training.make_train_step.
     """
-    # Reset the metrics at the start of epoch.
-    test_metrics_loss.reset_state()
-    test_metrics_accuracy.reset_state()
 
-    # Train model.
-    for images, labels in data_loader:
+    num_replicas = 1 if strategy is None else strategy.num_replicas_in_sync
+
+    def step(images, labels):
         predictions = model(images, training=False)
         loss = loss_object(labels, predictions)
 
-        # Update state of metircs.
-        test_metrics_loss(loss)
+        # Update state of metircs. keras divides the loss by the number of
+        # replicas inside a strategy, see training.make_train_step.
+        test_metrics_loss(loss * num_replicas)
         test_metrics_accuracy(labels, predictions)
+        if sampler is not None:
+            sampler.update_state(images, labels, predictions)
 
-    test_loss = test_metrics_loss.result()
-    test_accuracy = test_metrics_accuracy.result()
+    if sampler is not None and strategy is not None:
+        raise ValueError("ValidationSampler is not supported with a strategy.")
 
-    test_loss = test_loss.numpy()
-    test_accuracy = test_accuracy.numpy()
+    return compile_step(step, steps_per_execution, strategy, jit_compile)
 
-    return test_loss, test_accuracy
 
+def test_epoch(
+    data_loader,
+    eval_step,
+    test_metrics_loss,
+    test_metrics_accuracy,
+    steps_per_execution=1,
+    sampler=None,
+):
+    """
+    Function for testing(validation) model in one epoch.
 
-def sample_test(data_loader, model):
-    dataset_temp = data_loader.shuffle(
-        1000, reshuffle_each_iteration=True
-    ).unbatch()
-    dataset_temp = list(dataset_temp.as_numpy_iterator())
+    Parameters
+    ----------
+        data_loader : tf.data.Dataset
+            dataset for testing.
+        eval_step : tf.function
+            function built by make_eval_step.
+        test_metrics_loss : tf.keras.metrics
+        test_metrics_accuracy : tf.keras.metrics
+        steps_per_execution : int
+            the value eval_step was built with.
+        sampler : ValidationSampler or None
+            the sampler eval_step was built with. reset at the start of epoch.
+
+    Returns
+    -------
+        test_loss : float
+            loss during test.
+        test_accuracy : float
+            accuracy during test.
+    """
+    # Reset the metrics at the start of epoch.
+    test_metrics_loss.reset_state()
+    test_metrics_accuracy.reset_state()
+    if sampler is not None:
+        sampler.reset_state()
 
-    sample_data, sample_label = dataset_temp[0]
-    sample_prediction = model(sample_data[tf.newaxis, ...], training=False)
+    # Test model.
+    run_steps(data_loader, eval_step, steps_per_execution)
 
-    sample_prediction = tf.math.argmax(
-        tf.squeeze(tf.nn.softmax(sample_prediction))
-    ).numpy()
+    test_loss = float(test_metrics_loss.result().numpy())
+    test_accuracy = float(test_metrics_accuracy.result().numpy())
 
-    return sample_data, sample_label, sample_prediction
+    return test_loss, test_accuracy
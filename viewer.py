@@ -0,0 +1,58 @@
+"""Module for showing metrics of a headless training run in the gui."""
+import sys
+import argparse
+import numpy as np
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QTimer
+from gui import Main
+from metrics_log import read_records
+from config import METRICS_LOG_PATH
+
+
+POLL_INTERVAL = 500
+
+
+class Viewer:
+    """
+    A class to tail a metrics log into gui.Main.
+
+    Attributes
+    ----------
+        path : string
+            path of the log.
+        gui : gui.Main
+        position : int
+            byte offset of the log read so far.
+        timer : QTimer
+            polls the log every POLL_INTERVAL milliseconds.
+    """
+
+    def __init__(self, path, gui):
+        self.path = path
+        self.gui = gui
+        self.position = 0
+
+        self.timer = QTimer()
+        self.timer.setInterval(POLL_INTERVAL)
+        self.timer.timeout.connect(self.poll)
+        self.timer.start()
+        self.poll()
+
+    def poll(self):
+        records, self.position = read_records(self.path, self.position)
+        for record in records:
+            if record.get("type") != "epoch":
+                continue
+            record["sample_image"] = np.asarray(record["sample_image"], np.uint8)
+            self.gui.update_metrics(record)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show metrics log in the gui.")
+    parser.add_argument("path", nargs="?", default=METRICS_LOG_PATH)
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    ex = Main()
+    viewer = Viewer(args.path, ex)
+    sys.exit(app.exec_())